@@ -1,3 +1,5 @@
+from concurrent.futures import ThreadPoolExecutor
+
 import FreeCAD
 from FreeCAD import Base
 from utils.timer import Timer, computeOverallTime
@@ -5,6 +7,19 @@ from utils.qtutils import processEvents, QThread
 
 CANCEL_TASK = False
 
+class ParallelSteps(object):
+    '''Processing steps that only depend on the return value of the step before them.
+    They are executed at the same time in worker threads, each one with the same return value of the step before.
+    When all of them are done merge(lastReturnValue, results) combines the results in the order of the steps.
+    Its return value is passed to the next step.'''
+
+    def __init__(self, steps, merge):
+        self.steps = steps
+        self.merge = merge
+
+    def describe(self):
+        return ', '.join(description for description, step in self.steps)
+
 class WorkerThread(QThread):
     def __init__(self, processor, fp, startParameter):
         super(WorkerThread, self).__init__()
@@ -15,6 +30,9 @@ class WorkerThread(QThread):
         self.running = True
 
     def executeStep(self, step, lastReturnValue):
+        if isinstance(step, ParallelSteps):
+            return self.executeParallelSteps(step, lastReturnValue)
+
         if self.fp is not None:
             if lastReturnValue is not None:
                 lastReturnValue = step(self.fp, lastReturnValue)
@@ -28,6 +46,15 @@ class WorkerThread(QThread):
 
         return lastReturnValue
 
+    def executeParallelSteps(self, parallelSteps, lastReturnValue):
+        with ThreadPoolExecutor(max_workers=len(parallelSteps.steps)) as executor:
+            futures = [executor.submit(self.executeStep, step, lastReturnValue) for description, step in parallelSteps.steps]
+
+            # Raises the exception of the first failed step
+            results = [future.result() for future in futures]
+
+        return parallelSteps.merge(lastReturnValue, results)
+
     def run(self):
         global CANCEL_TASK
         CANCEL_TASK = False
@@ -54,6 +81,9 @@ class WorkerThread(QThread):
                     print('Cancelling step %s' % (stepDescription))
                     break
                 
+                if isinstance(step, ParallelSteps):
+                    stepDescription = '%s [%s]' % (stepDescription, step.describe())
+
                 timers.append(Timer('%s (%s/%s)' % (stepDescription, actualStep, numberOfSteps)))
 
                 lastReturnValue = self.executeStep(step, lastReturnValue)
@@ -1,23 +1,63 @@
 '''Base FeaturePython implementation that can handle boolean operations with meshes'''
 
+import math
+import hashlib
+
 import FreeCAD
 import Mesh
 
 from base_lithophane_processor import BaseLithophaneProcessor
 from utils.resource_utils import iconPath
+from utils.cache import LRUCache
 import utils.qtutils as qtutils
 from utils import preferences
 
-MODE_MAPPING = {
-    'Additive': 'union',
-    'Subtractive': 'difference'
-}
-
 ICON_MAPPING = {
     'Additive': iconPath('BooleanMeshFeatureAdd.svg'),
     'Subtractive': iconPath('BooleanMeshFeatureSubtract.svg')
 }
 
+# Tessellated shapes of all features. Keyed by the geometry of the shape and the deflection.
+TESSELLATION_CACHE = LRUCache(0, lambda mesh: meshSize(mesh))
+
+
+def tessellationCache():
+    TESSELLATION_CACHE.resize(preferences.getTessellationCacheSize() * 1024 * 1024)
+
+    return TESSELLATION_CACHE
+
+def meshSize(mesh):
+    '''Approximate memory in bytes used by the mesh. A point has 3 floats and a facet 3 point and 3 neighbour indices'''
+    return mesh.CountPoints * 12 + mesh.CountFacets * 24
+
+def shapeFingerprint(shape):
+    '''Hash of the geometry of the shape'''
+    return hashlib.sha1(shape.exportBrepToString().encode('utf-8')).hexdigest()
+
+def tessellate(shape, linearDeflection, angularDeflection):
+    '''Mesh of the shape. Shapes with the same geometry are tessellated only once.
+    The placement of the shape is not part of the key. So moving a shape does not tessellate it again.'''
+    import MeshPart
+
+    shape = shape.copy(False)
+    placement = shape.Placement
+    shape.Placement = FreeCAD.Placement()
+
+    key = (shapeFingerprint(shape), linearDeflection, angularDeflection)
+    cache = tessellationCache()
+    mesh = cache.get(key)
+
+    if mesh is None:
+        mesh = MeshPart.meshFromShape(Shape=shape, LinearDeflection=linearDeflection,
+                                      AngularDeflection=math.radians(angularDeflection), Relative=False)
+        cache.put(key, mesh)
+
+    # The cached mesh is shared, so only copies are moved
+    mesh = mesh.copy()
+    mesh.transform(placement.toMatrix())
+
+    return mesh
+
 
 class BooleanMeshProcessor(BaseLithophaneProcessor):
     def __init__(self, description, checkExecutionFunction, extractMeshFunction, processingStepsFunction):
@@ -50,16 +90,16 @@ class BooleanMeshFeature(object):
         obj.Base.ViewObject.Visibility = False
 
     def execute(self, obj):
-        import MeshPart
-
         base = obj.Base
+        linearDeflection = obj.LinearDeflection.Value
+        angularDeflection = obj.AngularDeflection.Value
 
-        if hasattr(base, 'Mesh') and isinstance(base, Mesh.Mesh):
-            self.mesh = base
+        if hasattr(base, 'Mesh') and isinstance(base.Mesh, Mesh.Mesh):
+            self.mesh = base.Mesh.copy()
         elif hasattr(base, 'Shape') and base.Shape:
-            self.mesh = MeshPart.meshFromShape(base.Shape.copy(False))
+            self.mesh = tessellate(base.Shape, linearDeflection, angularDeflection)
         else:
-            self.mesh = MeshPart.meshFromShape(base.copy(False))
+            self.mesh = tessellate(base, linearDeflection, angularDeflection)
 
     def getMesh(self):
         if not self.mesh:
@@ -67,16 +107,6 @@ class BooleanMeshFeature(object):
 
         return self.mesh
 
-    def applyOperationToMesh(self, mesh):
-        if not self.Object.Enabled:
-            return mesh
-
-        import OpenSCADUtils
-
-        openscadOperation = MODE_MAPPING[self.Object.Mode]
-
-        return OpenSCADUtils.meshoptempfile(openscadOperation, (mesh, self.getMesh()))
-
     def setProperties(self, obj):
         self.Object = obj
         self.mesh = None
@@ -97,6 +127,14 @@ class BooleanMeshFeature(object):
             obj.addProperty("App::PropertyBool", "Enabled", "Boolean",
                             "When False, the operation will not be applied").Enabled = True
 
+        if not 'LinearDeflection' in pl:
+            obj.addProperty("App::PropertyLength", "LinearDeflection", "Tessellation",
+                            "Maximum distance between the mesh and the surface of a shape. Smaller values create finer meshes").LinearDeflection = 0.1
+
+        if not 'AngularDeflection' in pl:
+            obj.addProperty("App::PropertyAngle", "AngularDeflection", "Tessellation",
+                            "Maximum angle between the facets of the mesh of a curved surface").AngularDeflection = 28.5
+
     def onDocumentRestored(self, obj):
         self.setProperties(obj)
 
@@ -176,6 +214,38 @@ class BooleanMesh(object):
     def getBaseProcessingSteps(self, obj):
         raise NotImplementedError
 
+    def getShapeParameters(self, obj):
+        '''Everything besides the point grid of the image that changes the base mesh.
+        Subclasses with properties that change the geometry must override this.'''
+        return ()
+
+    def getBaseMesh(self, obj, description):
+        '''The mesh built by the base processing steps. It is built again only when the point grid of the image
+        or the shape parameters changed. So changing the features only needs the boolean operations.'''
+        baseMeshProcessor = BooleanMeshProcessor(
+            description + " (Base)", self.checkBaseMeshExecution, self.extractBaseMesh, self.getBaseProcessingSteps)
+
+        if obj.LithophaneImage is None:
+            baseMeshProcessor.execute(obj)
+
+            return baseMeshProcessor.result
+
+        pointGrid = obj.LithophaneImage.Proxy.pointGrid
+        shapeParameters = self.getShapeParameters(obj)
+
+        # The grid itself is stored, so its id can not be reused by another grid
+        if self.baseMeshCache is not None and self.baseMeshCache[0] is pointGrid and self.baseMeshCache[1] == shapeParameters:
+            FreeCAD.Console.PrintMessage('%s: Base mesh did not change\n' % (description))
+
+            return self.baseMeshCache[2]
+
+        baseMeshProcessor.execute(obj)
+
+        if baseMeshProcessor.result is not None:
+            self.baseMeshCache = (pointGrid, shapeParameters, baseMeshProcessor.result)
+
+        return baseMeshProcessor.result
+
     def getResultName(self, obj):
         if not obj.LithophaneImage:
             return "Result"
@@ -191,45 +261,63 @@ class BooleanMesh(object):
 
         resultMesh = Mesh.Mesh()
 
-        description = self.getDescription()
+        features = [feature for feature in obj.Features if feature.Enabled]
 
-        baseMeshProcessor = BooleanMeshProcessor(
-            description + " (Base)", self.checkBaseMeshExecution, self.extractBaseMesh, self.getBaseProcessingSteps)
-        baseMeshProcessor.execute(obj)
+        # The leading features a subclass applies to the heights of the image. They need no boolean operation
+        features = features[len(self.getHeightfieldFeatures(obj)):]
 
-        if preferences.useBlenderForBooleanOperations():
-            mesh = self.executeBlender(baseMeshProcessor.result, obj)
-        else:
-            mesh = self.executeOpenSCAD(baseMeshProcessor.result, obj)
+        mesh = None
+
+        if len(features) > 0:
+            mesh = self.executeLocalized(obj, features)
+
+        if mesh is None:
+            baseMesh = self.getBaseMesh(obj, self.getDescription())
+            mesh = self.applyBooleanOperations(baseMesh, features)
 
         resultMesh.addMesh(mesh)
 
         obj.Result.Mesh = resultMesh
 
-    def executeOpenSCAD(self, basemesh, obj):
-        if len(obj.Features) == 0:
-            return basemesh
+    def getHeightfieldFeatures(self, obj):
+        '''The leading enabled features that are already part of the base mesh, because the subclass applied them
+        to the heights of the image. Only the features after them are applied by boolean operations.'''
+        return []
 
-        mesh = basemesh
+    def executeLocalized(self, obj, features):
+        '''Subclasses can apply the boolean operations only to the part of the mesh the features touch.
+        Returns the resulting mesh or None to apply the operations to the whole base mesh.'''
+        return None
 
-        for meshFeature in obj.Features:
-            mesh = meshFeature.Proxy.applyOperationToMesh(mesh)
+    def applyBooleanOperations(self, basemesh, features):
+        '''Applies the operations of the enabled features to the mesh'''
+        if preferences.useBlenderForBooleanOperations():
+            return self.executeBlender(basemesh, features)
 
-        return mesh
+        return self.executeOpenSCAD(basemesh, features)
 
-    def executeBlender(self, basemesh, obj):
-        if len(obj.Features) == 0:
+    def executeOpenSCAD(self, basemesh, features):
+        # no operations enabled
+        if len(features) == 0:
             return basemesh
 
-        from blender import blender_processor
+        from utils import openscad_processor
 
         operations = [(feature.Proxy.getMesh(), feature.Mode, feature.Name)
-                      for feature in obj.Features if feature.Enabled]
+                      for feature in features]
 
+        return openscad_processor.applyBooleanOperations(basemesh, operations)
+
+    def executeBlender(self, basemesh, features):
         # no operations enabled
-        if len(operations) == 0:
+        if len(features) == 0:
             return basemesh
 
+        from blender import blender_processor
+
+        operations = [(feature.Proxy.getMesh(), feature.Mode, feature.Name)
+                      for feature in features]
+
         return blender_processor.applyBooleanOperations(basemesh, operations)
 
     def addAdditiveFeature(self, base):
@@ -242,6 +330,9 @@ class BooleanMesh(object):
         self.Object = obj
         self.isBooleanMesh = True
 
+        # (pointGrid, shapeParameters, mesh) of the last base mesh
+        self.baseMeshCache = None
+
         pl = obj.PropertiesList
 
         if not 'LithophaneImage' in pl:
@@ -1,10 +1,13 @@
 '''Creates the wires and part objects'''
 
+import numpy
 import FreeCAD
-import Mesh
 
 import lithophane_utils
+from utils import mesh_utils
+from utils import heightfield_features
 from utils.resource_utils import iconPath
+from base_lithophane_processor import ParallelSteps
 from boolean_mesh import BooleanMesh
 from boolean_mesh import ViewProviderBooleanMesh
 from create_geometry_base import CreateGeometryBase
@@ -14,6 +17,9 @@ class ProcessingParameters(object):
     def __init__(self, image):
         self.image = image
 
+        self.heights = None
+        self.topology = None
+        self.vertices = None
         self.box = None
         self.imagePlane = None
         self.blockBase = None
@@ -21,9 +27,103 @@ class ProcessingParameters(object):
 
 
 class BoxLithophane(BooleanMesh):
+    # (pointGrid, features, meshes, heightfield) of the last features applied to the heights of the image
+    heightfieldCache = None
+
+    # Changes whenever the features applied to the heights change. So the base mesh is built again
+    heightfieldVersion = 0
+
     def __init__(self, obj):
         super().__init__(obj)
 
+    def setProperties(self, obj):
+        super(BoxLithophane, self).setProperties(obj)
+
+        pl = obj.PropertiesList
+
+        if not 'AdaptiveMesh' in pl:
+            obj.addProperty("App::PropertyBool", "AdaptiveMesh", "Mesh",
+                            "Use bigger triangles for areas of the image with (almost) the same height").AdaptiveMesh = False
+
+        if not 'MeshTolerance' in pl:
+            obj.addProperty("App::PropertyLength", "MeshTolerance", "Mesh",
+                            "Maximum height difference of points that are merged by the adaptive mesh. 0 uses 0.4 times the layer height of the image").MeshTolerance = 0
+
+        if not 'LocalizedBoolean' in pl:
+            obj.addProperty("App::PropertyBool", "LocalizedBoolean", "Feature",
+                            "Apply the boolean operations only to the parts of the box around the features").LocalizedBoolean = False
+
+        if not 'LocalizedPadding' in pl:
+            obj.addProperty("App::PropertyLength", "LocalizedPadding", "Feature",
+                            "Distance between the features and the border of the parts the boolean operations are applied to").LocalizedPadding = 2
+
+        if not 'HeightfieldFeatures' in pl:
+            obj.addProperty("App::PropertyBool", "HeightfieldFeatures", "Feature",
+                            "Apply features that are vertical extrusions to the heights of the image instead of using boolean operations").HeightfieldFeatures = False
+
+    def meshTolerance(self, obj):
+        '''The tolerance of the adaptive mesh or None to use a triangle pair for every cell'''
+        if not obj.AdaptiveMesh:
+            return None
+
+        if obj.MeshTolerance.Value > 0:
+            return obj.MeshTolerance.Value
+
+        # Less than half a layer, so points of different layers are never merged
+        return 0.4 * obj.LithophaneImage.LayerHeight.Value
+
+    def getShapeParameters(self, obj):
+        self.featureHeightfield(obj)
+
+        return (self.meshTolerance(obj), self.heightfieldVersion)
+
+    def getHeightfieldFeatures(self, obj):
+        if obj.LithophaneImage is None:
+            return []
+
+        return self.featureHeightfield(obj)[2]
+
+    def featureHeightfield(self, obj):
+        '''(heights, removedCells, features) of the image with the leading enabled features applied to it.
+        Only features that are vertical extrusions standing on the ground or reaching above the image can be applied.
+        The first feature that can not be applied and all features after it are applied by boolean operations.'''
+        pointGrid = obj.LithophaneImage.Proxy.pointGrid
+        features = [feature for feature in obj.Features if feature.Enabled] if obj.HeightfieldFeatures else []
+        meshes = [feature.Proxy.getMesh() for feature in features]
+
+        cache = self.heightfieldCache
+
+        if (cache is not None and cache[0] is pointGrid and cache[1] == [(feature.Name, feature.Mode) for feature in features] and
+                len(cache[2]) == len(meshes) and all(cachedMesh is mesh for cachedMesh, mesh in zip(cache[2], meshes))):
+            return cache[3]
+
+        heights = pointGrid.heights
+        removedCells = numpy.zeros((pointGrid.numberOfLines() - 1, pointGrid.numberOfRows() - 1), dtype=bool)
+        appliedFeatures = []
+
+        # Points of meshes are float32
+        tolerance = 1e-3
+
+        for feature, mesh in zip(features, meshes):
+            try:
+                points, facets = lithophane_utils.meshToArrays(mesh)
+                extrusion = heightfield_features.extrusionOfMesh(points, facets, tolerance)
+
+                heights, removedCells = heightfield_features.applyExtrusion(heights, removedCells, extrusion, feature.Mode,
+                                                                            pointGrid.xCoordinates(), pointGrid.yCoordinates(), tolerance)
+            except heightfield_features.NotAHeightfield as e:
+                FreeCAD.Console.PrintMessage('%s: %s can not be applied to the heights of the image because %s. It and all following features are applied by boolean operations\n' % (
+                    obj.Label, feature.Label, e))
+
+                break
+
+            appliedFeatures.append(feature)
+
+        self.heightfieldCache = (pointGrid, [(feature.Name, feature.Mode) for feature in features], meshes, (heights, removedCells, appliedFeatures))
+        self.heightfieldVersion += 1
+
+        return self.heightfieldCache[3]
+
     def getDescription(self):
         return 'CreateBox'
     
@@ -31,151 +131,142 @@ class BoxLithophane(BooleanMesh):
         return iconPath('CreateBox.svg')
 
     def getBaseProcessingSteps(self, obj):
-        return [('Image Plane', self.makeImagePlane),
-                ('Image Base', self.makeBlockBase),
-                ('Bottom Plane', self.createBottomRectangle),
+        # The parts only depend on the topology. So they are built at the same time
+        meshParts = ParallelSteps([('Vertices', self.makeVertices),
+                                   ('Image Plane', self.makeImagePlane),
+                                   ('Image Base', self.makeBlockBase),
+                                   ('Bottom Plane', self.createBottomRectangle)], self.mergeMeshParts)
+
+        return [('Topology', self.makeTopology),
+                ('Mesh Parts', meshParts),
                 ('Merge Meshes', self.mergeMeshes),
                 ('Optimize Mesh', self.optimizeMesh)]
 
     def extractBaseMesh(self, obj, processingParameters):
         return processingParameters.box
 
-    def makeImagePlane(self, obj, image):
+    def makeTopology(self, obj, image):
         processingParameters = ProcessingParameters(image)
-        lines = processingParameters.image.lines
+        processingParameters.heights, removedCells = self.featureHeightfield(obj)[:2]
 
-        facets = []
+        # The facets of all parts reference the same vertices. So there is one index array per part
+        if removedCells.any():
+            processingParameters.topology = mesh_utils.HeightfieldTopology(processingParameters.heights, removedCells)
+        else:
+            processingParameters.topology = mesh_utils.BoxTopology(processingParameters.heights, self.meshTolerance(obj))
 
-        for lineNumber, actualLine in enumerate(lines):
-            # No need to perform operations on the last line at all
-            if lineNumber == len(lines) - 1:
-                break
+        return processingParameters
+
+    def makeVertices(self, obj, processingParameters):
+        pointGrid = processingParameters.image.pointGrid
 
-            nextLine = lines[lineNumber + 1]
+        return processingParameters.topology.vertices(pointGrid.xCoordinates(), pointGrid.yCoordinates(), processingParameters.heights)
 
-            for rowNumber, actualPoint in enumerate(actualLine):
-                # No need to perform operations on the last row
-                if rowNumber == len(actualLine) - 1:
-                    break
+    def makeImagePlane(self, obj, processingParameters):
+        return processingParameters.topology.imagePlaneFacets()
 
-                bottomLeft = actualPoint
-                bottomRight = actualLine[rowNumber + 1]  # next row same line
-                topRight = nextLine[rowNumber + 1]  # next row next line
-                topLeft = nextLine[rowNumber]  # same row next line
+    def makeBlockBase(self, obj, processingParameters):
+        return processingParameters.topology.blockBaseFacets()
 
-                facets.extend([bottomLeft, bottomRight, topLeft])
-                facets.extend([bottomRight, topRight, topLeft])
+    def createBottomRectangle(self, obj, processingParameters):
+        return processingParameters.topology.bottomFacets()
 
-        processingParameters.imagePlane = Mesh.Mesh(facets)
+    def mergeMeshParts(self, processingParameters, parts):
+        processingParameters.vertices, processingParameters.imagePlane, processingParameters.blockBase, processingParameters.bottomRectangle = parts
 
         return processingParameters
 
-    def makeBlockBase(self, obj, processingParameters):
-        lines = processingParameters.image.lines
+    def mergeMeshes(self, obj, processingParameters):
+        facets = numpy.concatenate((processingParameters.imagePlane, processingParameters.blockBase, processingParameters.bottomRectangle))
+
+        processingParameters.box = lithophane_utils.meshFromArrays(processingParameters.vertices, facets)
 
-        facets = []
+        return processingParameters
 
-        # add the bottom rectangle
-        # bottomLeftCorner = lithophane_utils.vectorAtGround(lines[0][0])
-        # bottomRightCorner = lithophane_utils.vectorAtGround(lines[0][-1])
-        # topRightCorner = lithophane_utils.vectorAtGround(lines[-1][-1])
-        # topLeftCorner = lithophane_utils.vectorAtGround(lines[-1][0])
+    def optimizeMesh(self, obj, processingParameters):
+        processingParameters.box.harmonizeNormals()
 
-        # facets.extend([bottomLeftCorner, topLeftCorner, bottomRightCorner])
-        # facets.extend([bottomRightCorner, topLeftCorner, topRightCorner])
+        return processingParameters
 
-        for lineNumber, actualLine in enumerate(lines):
-            # Need to process all the points on the first and last line
-            if lineNumber == 0 or lineNumber == len(lines) - 1:
-                for rowNumber, actualPoint in enumerate(actualLine):
-                    # No need to perform operations on the last row
-                    if rowNumber == len(actualLine) - 1:
-                        break
 
-                    nextPoint = actualLine[rowNumber + 1]
+    def executeLocalized(self, obj, features):
+        '''Applies the boolean operations to the boxes of the grid regions around the features only.
+        Every feature gets its own region, only regions that touch each other are merged.
+        The rest of the box is built around them and all are stitched together afterwards.'''
+        if not obj.LocalizedBoolean or obj.LithophaneImage is None:
+            return None
 
-                    bottomLeft = lithophane_utils.vectorAtGround(actualPoint)
-                    bottomRight = lithophane_utils.vectorAtGround(nextPoint)
-                    topRight = nextPoint
-                    topLeft = actualPoint
+        heights, removedCells = self.featureHeightfield(obj)[:2]
 
-                    facets.extend([bottomLeft, bottomRight, topLeft])
-                    facets.extend([bottomRight, topRight, topLeft])
+        # The remainder can not be built around holes
+        if removedCells.any():
+            return None
 
-            # Only use the first and last point for all other rows
-            if lineNumber > 0:
-                previousLine = lines[lineNumber - 1]
+        pointGrid = obj.LithophaneImage.Proxy.pointGrid
+        xCoordinates = pointGrid.xCoordinates()
+        yCoordinates = pointGrid.yCoordinates()
 
-                firstPoint = actualLine[0]
-                prevFirstPoint = previousLine[0]
-                lastPoint = actualLine[-1]
-                prevLastPoint = previousLine[-1]
+        regions = []
 
-                bottomLeft1 = lithophane_utils.vectorAtGround(firstPoint)
-                bottomRight1 = lithophane_utils.vectorAtGround(prevFirstPoint)
-                topRight1 = prevFirstPoint
-                topLeft1 = firstPoint
+        for feature in features:
+            boundBox = feature.Proxy.getMesh().BoundBox
+            region = mesh_utils.gridRegion(xCoordinates, yCoordinates,
+                                           (boundBox.XMin, boundBox.XMax, boundBox.YMin, boundBox.YMax), obj.LocalizedPadding.Value)
 
-                facets.extend([bottomRight1, topRight1, bottomLeft1])
-                facets.extend([topRight1, topLeft1, bottomLeft1])
+            if region is None:
+                return None
 
-                bottomLeft2 = lithophane_utils.vectorAtGround(prevLastPoint)
-                bottomRight2 = lithophane_utils.vectorAtGround(lastPoint)
-                topRight2 = lastPoint
-                topLeft2 = prevLastPoint
+            regions.append(region)
 
-                facets.extend([bottomLeft2, bottomRight2, topLeft2])
-                facets.extend([bottomRight2, topRight2, topLeft2])
+        regions = mesh_utils.mergedRegions(regions)
 
-        processingParameters.blockBase = Mesh.Mesh(facets)
+        if (0, len(yCoordinates) - 1, 0, len(xCoordinates) - 1) in regions:
+            return None
 
-        return processingParameters
+        tolerance = self.meshTolerance(obj)
+        patchPoints = []
+        patchFacets = []
+        numberOfPoints = 0
 
-    def createBottomRectangle(self, obj, processingParameters):
-        lines = processingParameters.image.lines
+        for firstLine, lastLine, firstRow, lastRow in regions:
+            patchHeights = heights[firstLine:lastLine + 1, firstRow:lastRow + 1]
+            patch = mesh_utils.BoxTopology(patchHeights, tolerance)
 
-        facets = []
+            patchPoints.append(patch.vertices(xCoordinates[firstRow:lastRow + 1], yCoordinates[firstLine:lastLine + 1], patchHeights))
+            patchFacets.append(numpy.concatenate((patch.imagePlaneFacets(), patch.blockBaseFacets(), patch.bottomFacets())) + numberOfPoints)
+            numberOfPoints += len(patchPoints[-1])
 
-        for lineNumber, actualLine in enumerate(lines):
-            # No need to perform operations on the last line at all
-            if lineNumber == len(lines) - 1:
-                break
+        # The boxes of all regions are a single mesh. So all operations are still applied in a single run
+        patchMesh = lithophane_utils.meshFromArrays(numpy.concatenate(patchPoints), numpy.concatenate(patchFacets))
+        patchMesh.harmonizeNormals()
 
-            nextLine = lines[lineNumber + 1]
+        patchResult = self.applyBooleanOperations(patchMesh, features)
 
-            for rowNumber, actualPoint in enumerate(actualLine):
-                # No need to perform operations on the last row
-                if rowNumber == len(actualLine) - 1:
-                    break
+        if patchResult is None:
+            return None
 
-                bottomLeft = lithophane_utils.vectorAtGround(actualPoint)
-                bottomRight = lithophane_utils.vectorAtGround(
-                    actualLine[rowNumber + 1])  # next row same line
-                topRight = lithophane_utils.vectorAtGround(
-                    nextLine[rowNumber + 1])  # next row next line
-                topLeft = lithophane_utils.vectorAtGround(
-                    nextLine[rowNumber])  # same row next line
+        patchPoints, patchFacets = lithophane_utils.meshToArrays(patchResult)
 
-                facets.extend([bottomLeft, bottomRight, topLeft])
-                facets.extend([bottomRight, topRight, topLeft])
+        remainder = mesh_utils.RemainderTopology(heights, regions, tolerance)
+        remainderPoints = remainder.vertices(xCoordinates, yCoordinates, heights)
+        remainderFacets = numpy.concatenate((remainder.imagePlaneFacets(), remainder.blockBaseFacets(), remainder.bottomFacets()))
 
-        processingParameters.bottomRectangle = Mesh.Mesh(facets)
+        # Points read back from the boolean operation are not exactly the ones written
+        seamTolerance = pointGrid.spacing / 10
 
-        return processingParameters
+        points, facets, closed = mesh_utils.stitchPatch(remainderPoints, remainderFacets, remainder.seamIndices(), patchPoints, patchFacets,
+                                                        remainder.cutPlanes(xCoordinates, yCoordinates), seamTolerance)
 
-    def mergeMeshes(self, obj, processingParameters):
-        processingParameters.box = Mesh.Mesh()
-        processingParameters.box.addMesh(processingParameters.imagePlane)
-        processingParameters.box.addMesh(processingParameters.blockBase)
-        processingParameters.box.addMesh(processingParameters.bottomRectangle)
+        if closed:
+            mesh = lithophane_utils.meshFromArrays(points, facets)
+            mesh.harmonizeNormals()
 
-        return processingParameters
+            if mesh.isSolid():
+                return mesh
 
-    def optimizeMesh(self, obj, processingParameters):
-        processingParameters.box.removeDuplicatedPoints()
-        processingParameters.box.harmonizeNormals()
+        FreeCAD.Console.PrintWarning('%s: The localized boolean operations did not create a solid. Applying them to the whole mesh\n' % (obj.Label))
 
-        return processingParameters
+        return None
 
 
 class CreateGeometryCommand(CreateGeometryBase):
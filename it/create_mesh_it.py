@@ -0,0 +1,111 @@
+import os
+import FreeCAD
+from freecad_it.freecad_utils import getObject, recompute
+from freecad_it.asserting import assertThat, isEqualTo, isFalse
+
+import lithophane_image
+import create_box
+import create_tube
+import boolean_mesh
+
+# Utils
+def imagePath(fileName):
+    imagePath = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'testimages', fileName)
+
+    return imagePath
+
+def importImage(imageName):
+    lithophane_image.createImage(imagePath(imageName + '.png'))
+
+    return getObject(imageName)
+
+def createMesh(command, imageObject):
+    command.createGeometryInstance(imageObject, imageObject.Label)
+
+    return getObject(imageObject.Label + '_Mesh')
+
+def resultMesh(meshObject):
+    recompute()
+
+    return meshObject.Result.Mesh
+
+def assertIsClosedSolid(mesh):
+    assertThat(mesh.isSolid(), isEqualTo(True))
+    assertThat(mesh.hasNonManifolds(), isFalse())
+    assertThat(mesh.Volume > 0, isEqualTo(True))
+
+# Tests
+
+def boxIsClosedSolid():
+    mesh = resultMesh(createMesh(create_box.CreateGeometryCommand(), importImage('small')))
+
+    assertIsClosedSolid(mesh)
+
+    # The small image ends up in 10x10 points. The bottom only uses the 36 points on the border
+    assertThat(mesh.CountPoints, isEqualTo(100 + 36))
+    assertThat(mesh.CountFacets, isEqualTo(162 + 72 + 34))
+
+def adaptiveBoxIsClosedSolidWithLessFacets():
+    box = createMesh(create_box.CreateGeometryCommand(), importImage('small'))
+    gridMesh = resultMesh(box)
+
+    box.AdaptiveMesh = True
+    adaptiveMesh = resultMesh(box)
+
+    assertIsClosedSolid(adaptiveMesh)
+    assertThat(adaptiveMesh.CountFacets < gridMesh.CountFacets, isEqualTo(True))
+
+    # The heights are rounded to layers. So only points with the same height are merged and the volume stays the same
+    assertThat(abs(adaptiveMesh.Volume - gridMesh.Volume) < 1e-3, isEqualTo(True))
+
+def adaptiveBoxOfBlocksIsClosedSolid():
+    imageObject = importImage('blocks')
+    imageObject.NozzleSize = 0
+
+    box = createMesh(create_box.CreateGeometryCommand(), imageObject)
+    box.AdaptiveMesh = True
+
+    assertIsClosedSolid(resultMesh(box))
+
+def tubeIsClosedSolid():
+    mesh = resultMesh(createMesh(create_tube.CreateTubeCommand(), importImage('small')))
+
+    assertIsClosedSolid(mesh)
+
+    # 10x10 points of the outer surface and an inner ring of 10 points at the bottom and top
+    assertThat(mesh.CountPoints, isEqualTo(100 + 20))
+    assertThat(mesh.CountFacets, isEqualTo(180 + 20 + 20 + 20))
+
+def localizedBooleanIsStitchedForFeaturesInOppositeCorners():
+    imageObject = importImage('medium')
+    imageObject.ppi = 50 # 100x100 points with a distance of about 0.5 millimeters
+
+    box = createMesh(create_box.CreateGeometryCommand(), imageObject)
+
+    # Holes through the lithophane
+    for name, position in (('LowerLeft', 3), ('UpperRight', 45)):
+        cube = FreeCAD.ActiveDocument.addObject('Part::Box', name)
+        cube.Length = 2
+        cube.Width = 2
+        cube.Height = 10
+        cube.Placement.Base = FreeCAD.Vector(position, position, -2)
+
+        boolean_mesh.createFeature(box, cube, 'Subtractive')
+
+    wholeMesh = resultMesh(box)
+
+    box.LocalizedBoolean = True
+    mesh = resultMesh(box)
+
+    assertIsClosedSolid(mesh)
+    assertThat(abs(mesh.Volume - wholeMesh.Volume) < 0.01, isEqualTo(True))
+
+    # The result is None when the operations had to be applied to the whole mesh
+    localizedMesh = box.Proxy.executeLocalized(box, box.Features)
+
+    assertThat(localizedMesh is not None, isEqualTo(True))
+    assertThat(localizedMesh.CountFacets, isEqualTo(mesh.CountFacets))
+
+def collectTests():
+    return [boxIsClosedSolid, adaptiveBoxIsClosedSolidWithLessFacets, adaptiveBoxOfBlocksIsClosedSolid, tubeIsClosedSolid,
+            localizedBooleanIsStitchedForFeaturesInOppositeCorners]
@@ -0,0 +1,60 @@
+import numpy
+from freecad_it.asserting import assertThat, isEqualTo
+
+from utils import heightfield_features
+
+# A grid of 10x10 points with a distance of 0.4 millimeters at a height of 1 millimeter
+coordinates = numpy.arange(10) * 0.4
+heights = numpy.ones((10, 10))
+removedCells = numpy.zeros((9, 9), dtype=bool)
+
+# Utils
+def boxExtrusion(xMin, xMax, yMin, yMax, bottom, top):
+    '''The extrusion of a box as returned by extrusionOfMesh'''
+    triangles = numpy.array([[(xMin, yMin), (xMax, yMin), (xMin, yMax)],
+                             [(xMax, yMin), (xMax, yMax), (xMin, yMax)]])
+
+    return (bottom, top, triangles)
+
+def isRejected(extrusion, mode):
+    try:
+        heightfield_features.applyExtrusion(heights, removedCells, extrusion, mode, coordinates, coordinates, 1e-3)
+    except heightfield_features.NotAHeightfield:
+        return True
+
+    return False
+
+# Tests
+
+def additiveBoxRaisesThePoints():
+    newHeights, newRemovedCells = heightfield_features.applyExtrusion(heights, removedCells, boxExtrusion(0.4, 1.2, 0.4, 1.2, 0, 2),
+                                                                      'Additive', coordinates, coordinates, 1e-3)
+
+    assertThat(int(numpy.count_nonzero(newHeights == 2)), isEqualTo(9))
+    assertThat(bool(newRemovedCells.any()), isEqualTo(False))
+
+def subtractiveBoxRemovesTheCells():
+    newHeights, newRemovedCells = heightfield_features.applyExtrusion(heights, removedCells, boxExtrusion(0.4, 1.2, 0.4, 1.2, 0, 2),
+                                                                      'Subtractive', coordinates, coordinates, 1e-3)
+
+    assertThat(int(numpy.count_nonzero(newRemovedCells)), isEqualTo(4))
+
+def ribBetweenThePointsIsRejected():
+    # Narrower than the distance of the points. It covers the centers of cells but no point
+    rib = boxExtrusion(1.3, 1.5, 0.4, 2.8, 0, 2)
+
+    assertThat(isRejected(rib, 'Additive'), isEqualTo(True))
+
+def loweringRibBetweenThePointsIsRejected():
+    rib = boxExtrusion(1.3, 1.5, 0.4, 2.8, 0.5, 2)
+
+    assertThat(isRejected(rib, 'Subtractive'), isEqualTo(True))
+
+def holeBetweenThePointsRemovesTheCells():
+    rib = boxExtrusion(1.3, 1.5, 0.4, 2.8, 0, 2)
+
+    assertThat(isRejected(rib, 'Subtractive'), isEqualTo(False))
+
+def collectTests():
+    return [additiveBoxRaisesThePoints, subtractiveBoxRemovesTheCells, ribBetweenThePointsIsRejected,
+            loweringRibBetweenThePointsIsRejected, holeBetweenThePointsRemovesTheCells]
@@ -1,9 +1,16 @@
 import os
+import gc
+import json
+import shutil
+import tempfile
 from freecad_it.freecad_utils import getObject, recompute, vector
-from freecad_it.asserting import assertThat, isNotNone, hasAttributeOfValue, isOfType, hasAttribute, matchesTowdimensionalListOfVectors
+from freecad_it.asserting import assertThat, isNotNone, isEqualTo, isFalse, hasAttributeOfValue, isOfType, hasAttribute, matchesTowdimensionalListOfVectors
 import freecad_it.logger as logger
 
 import lithophane_image
+from utils import preferences
+import utils.qtutils as qtutils
+from utils import worker_pool
 
 def buildSmallPointsReduced():
     points = []
@@ -118,5 +125,148 @@ def pointCloudIsCalculatedWithoutNozzleSizeForTransparency():
     assertThat(image, hasAttribute('lines'))
     assertThat(image.lines, matchesTowdimensionalListOfVectors(tiny_points))
 
+def pointCloudIsCalculatedInTiles():
+    imageObject = importImage('small')
+    imageObject.TiledProcessing = True
+    image = imageObject.Proxy
+
+    tileSize = preferences.getTileSize()
+    preferences.params.SetInt('TileSize', 7) # Every tile holds a single nozzle sized block
+
+    try:
+        recompute()
+    finally:
+        preferences.params.SetInt('TileSize', tileSize)
+
+    assertThat(image.lines, matchesTowdimensionalListOfVectors(small_points_reduced))
+
+def pointCloudIsCalculatedInTilesForJpeg():
+    # JPEG images decode only the lines of a tile. PNG images are decoded at once
+    directory = tempfile.mkdtemp()
+
+    try:
+        jpegPath = os.path.join(directory, 'small.jpg')
+        qtutils.QImage(imagePath('small.png')).save(jpegPath, 'JPG', 100)
+
+        lithophane_image.createImage(jpegPath)
+        imageObject = getObject('small')
+        image = imageObject.Proxy
+        recompute()
+
+        expectedLines = image.lines
+
+        imageObject.TiledProcessing = True
+
+        tileSize = preferences.getTileSize()
+        preferences.params.SetInt('TileSize', 7)
+
+        try:
+            recompute()
+        finally:
+            preferences.params.SetInt('TileSize', tileSize)
+
+        assertThat(qtutils.supportsClipRect(image.getImageData(), image.imageScale), isEqualTo(True))
+        assertThat(image.lines, matchesTowdimensionalListOfVectors(expectedLines))
+    finally:
+        shutil.rmtree(directory)
+
+def pointCloudIsCalculatedInWorkerProcesses():
+    imageObject = importImage('medium')
+    image = imageObject.Proxy
+    workerProcesses = preferences.getWorkerProcesses()
+    useHeightmapCache = preferences.useHeightmapCache()
+
+    # The cached results don't know which way they were computed
+    preferences.params.SetBool('UseHeightmapCache', False)
+
+    try:
+        preferences.params.SetInt('WorkerProcesses', 1)
+        recompute()
+
+        serialLines = image.lines
+
+        lithophane_image.STEP_CACHE.clear()
+        preferences.params.SetInt('WorkerProcesses', 2)
+        imageObject.touch()
+        recompute()
+    finally:
+        preferences.params.SetInt('WorkerProcesses', workerProcesses)
+        preferences.params.SetBool('UseHeightmapCache', useHeightmapCache)
+
+    # Python < 3.8 has no shared memory and always computes in a single process
+    if worker_pool.shared_memory is not None:
+        assertThat(image.parallel, isEqualTo(True))
+
+    assertThat(image.lines, matchesTowdimensionalListOfVectors(serialLines, 0.0001))
+
+def pointCloudIsRestoredFromDocumentState():
+    image = importImage('small').Proxy
+    recompute()
+
+    # FreeCAD stores the state as json
+    state = json.loads(json.dumps(image.__getstate__()))
+    image.__setstate__(state)
+
+    assertThat(image.lines, matchesTowdimensionalListOfVectors(small_points_reduced))
+
+def pointCloudIsRestoredFromOldDocumentState():
+    image = importImage('small').Proxy
+    recompute()
+
+    lineTuples = [[(point.x, point.y, point.z) for point in line] for line in image.lines]
+    state = json.loads(json.dumps((lithophane_image.imgToBase64(image.image), image.lastPath, lineTuples, image.maxHeight)))
+    image.__setstate__(state)
+
+    assertThat(image.lines, matchesTowdimensionalListOfVectors(small_points_reduced))
+
+def imageDataIsStoredOnceForTheSameImage():
+    image = importImage('small').Proxy
+    recompute()
+
+    otherImage = lithophane_image.createImage(imagePath('small.png'))
+    recompute()
+
+    assertThat('imageData' in image.__getstate__(), isEqualTo(True))
+    assertThat('imageData' in otherImage.__getstate__(), isFalse())
+
+    otherImage.__setstate__(json.loads(json.dumps(otherImage.__getstate__())))
+
+    assertThat(otherImage.lines, matchesTowdimensionalListOfVectors(small_points_reduced))
+
+    # Decoding the restored image and recomputing must not change the key of the shared image data
+    assertThat(otherImage.image.isNull(), isFalse())
+
+    image.Object.touch()
+    otherImage.Object.touch()
+    recompute()
+
+    assertThat(otherImage.imageHash, isEqualTo(image.imageHash))
+    assertThat(otherImage.getImageData(), isEqualTo(image.getImageData()))
+    assertThat(otherImage.computeImageHash(), isEqualTo(image.computeImageHash()))
+    assertThat(otherImage.lines, matchesTowdimensionalListOfVectors(small_points_reduced))
+
+def imageDataIsReleasedWhenNoImageUsesIt():
+    imageObject = importImage('small')
+    recompute()
+
+    smallHash = imageObject.Proxy.imageHash
+    assertThat(smallHash in lithophane_image.IMAGE_DATA, isEqualTo(True))
+
+    imageObject.Path = imagePath('tini.png')
+    recompute()
+    gc.collect()
+
+    tiniHash = imageObject.Proxy.imageHash
+    assertThat(smallHash in lithophane_image.IMAGE_DATA, isFalse())
+    assertThat(tiniHash in lithophane_image.IMAGE_DATA, isEqualTo(True))
+
+    imageObject.Document.removeObject(imageObject.Name)
+    imageObject = None
+    gc.collect()
+
+    assertThat(tiniHash in lithophane_image.IMAGE_DATA, isFalse())
+
 def collectTests():
-    return [isLoadedWithRightName, pointcloudIsCalculatedForDefaultProperties, pointCloudIsCalculatedWithoutNozzleSize, pointCloudIsCalculatedWithoutNozzleSizeForTransparency]
\ No newline at end of file
+    return [isLoadedWithRightName, pointcloudIsCalculatedForDefaultProperties, pointCloudIsCalculatedWithoutNozzleSize, pointCloudIsCalculatedWithoutNozzleSizeForTransparency, pointCloudIsCalculatedInTiles, pointCloudIsCalculatedInTilesForJpeg, pointCloudIsCalculatedInWorkerProcesses,
+            pointCloudIsRestoredFromDocumentState, pointCloudIsRestoredFromOldDocumentState,
+            imageDataIsStoredOnceForTheSameImage, imageDataIsReleasedWhenNoImageUsesIt]
\ No newline at end of file
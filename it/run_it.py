@@ -1,9 +1,13 @@
 from freecad_it.test_runner import TestRunner
 
 import lithophane_image_it
+import heightfield_features_it
+import create_mesh_it
 
 testRunner = TestRunner()
 
 testRunner.addTests(lithophane_image_it)
+testRunner.addTests(heightfield_features_it)
+testRunner.addTests(create_mesh_it)
 
 testRunner.run()
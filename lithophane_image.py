@@ -6,31 +6,42 @@ import sys
 IS_PY_2 = sys.version_info.major < 3
 
 import math, os
+import base64
+import hashlib
+import weakref
 import FreeCAD, FreeCADGui
 from pivy import coin
 
 from image_viewer import ImageViewer
-from utils.geometry_utils import pointCloudToLines
-from lithophane_utils import toChunks, tupleToVector, vectorToTuple, convertImageToTexture, recomputeView
+from lithophane_utils import convertImageToTexture, recomputeView
 from utils.timer import Timer, computeOverallTime
 import utils.qtutils as qtutils
+from utils import heightmap
+from utils.point_grid import PointGrid, gridToState, gridFromState, gridExtentFromState
+from utils.cache import LRUCache
+from utils import preferences
+from utils import heightmap_cache
+from utils import worker_pool
 from base_lithophane_processor import BaseLithophaneProcessor
 
-class AverageVector:
-    def __init__(self):
-        self.baseVector = None
-        self.heights = []
-    
-    def add(self, vector):
-        if self.baseVector is None:
-            self.baseVector = vector
-        
-        self.heights.append(vector.z)
-    
-    def average(self):
-        averageHeight = sum(self.heights) / len(self.heights)
+# Version of the data returned by LithophaneImage.__getstate__
+STATE_VERSION = 3
+
+# Content of all image files that are loaded. Keyed by the hash of the content.
+# So images with the same content share the data and it is stored only once in a document.
+# The content is dropped as soon as no image uses it anymore.
+IMAGE_DATA = weakref.WeakValueDictionary()
+
+# Maximum width and height of the image that is shown in tiled mode
+PREVIEW_SIZE = 2048
 
-        return FreeCAD.Vector(self.baseVector.x, self.baseVector.y, averageHeight)
+# Results of the processing steps of all images. Keyed by the inputs of the step.
+STEP_CACHE = LRUCache(0, lambda stepResult: stepResult[0].heights.nbytes)
+
+def stepCache():
+    STEP_CACHE.resize(preferences.getStepCacheSize() * 1024 * 1024)
+
+    return STEP_CACHE
 
 def mmPerPixel(ppi):
     pixelsPerMm = ppi / 25.4
@@ -38,11 +49,37 @@ def mmPerPixel(ppi):
     return 1 / pixelsPerMm
 
 def imageChanged(lithophaneImage, newPath):
-    if not hasattr(lithophaneImage, 'image') or not hasattr(lithophaneImage, 'lastPath'):
+    if lithophaneImage.imageHash is None or not hasattr(lithophaneImage, 'lastPath'):
         return True
     
     return newPath != lithophaneImage.lastPath
 
+def imageDataHash(imageData):
+    return hashlib.sha1(imageData).hexdigest()
+
+class SharedImageData(object):
+    '''Content of an image file that is shared by all images with the same content.
+    The images hold it, IMAGE_DATA only references it weakly'''
+    def __init__(self, data):
+        self.data = data
+
+def registerImageData(imageData):
+    '''Returns the hash of the image data and the data that is registered for it.
+    When another image with the same content is loaded already, its data is reused.'''
+    imageHash = imageDataHash(imageData)
+
+    sharedData = IMAGE_DATA.get(imageHash)
+
+    if sharedData is None:
+        sharedData = SharedImageData(imageData)
+        IMAGE_DATA[imageHash] = sharedData
+
+    return (imageHash, sharedData)
+
+def readImageFile(imagePath):
+    with open(imagePath, 'rb') as f:
+        return f.read()
+
 def imgToBase64(image):
     ba = qtutils.QByteArray()
     
@@ -57,16 +94,6 @@ def imgToBase64(image):
 
     return base64Data
 
-def imageFromBase64(base64):
-    base64Data = base64
-
-    if not IS_PY_2:
-        base64Data = base64Data.encode('utf-8')
-
-    ba = qtutils.QByteArray.fromBase64(qtutils.QByteArray(base64Data))
-    
-    return qtutils.QImage.fromData(ba, 'PNG')
-
 def calculatePixelHeight(image, x, y, baseHeight, maximumHeight):
     '''Calculate the height of the pixel based on its lightness value.
     Lighter colors mean lower height because the light must come through.
@@ -92,90 +119,140 @@ def calculatePixelHeight(image, x, y, baseHeight, maximumHeight):
 
     return baseHeight.Value + ((maximumHeight.Value - baseHeight.Value) * percentage) / 100
 
-def computeLines(image, ppi, baseHeight, maximumHeight):
-        pixelSize = mmPerPixel(ppi)
-        imageSize = image.size()
-        imageHeight = imageSize.height()
-        imageWidth = imageSize.width()
+def computeHeights(image, heightTable):
+    '''Calculate the heights of all pixels at once by looking them up in a table built by heightmap.heightTable.
+    Without tone mapping the values are the same calculatePixelHeight would return.
+    The rows are in image order. So the first row is the top row of the image.'''
+    argb = qtutils.imageToArgbArray(image)
 
-        pts = []
+    return heightmap.pixelHeights(argb, heightTable, qtutils.lightnessTable())
 
-        maxHeight = 0
+def computePointGrid(image, pixelSize, heightTable):
+    # QImage 0,0 is in the top left corner. Our point clouds 0,0 is in the bottom left corner
+    # So we reverse the rows to get the bottom row of the image as first line
+    heights = computeHeights(image, heightTable)[::-1]
 
-        # QImage 0,0 is in the top left corner. Our point clouds 0,0 is in the bottom left corner
-        # So we itereate over the height in reverse order and use the imagewidth - y as coordinate.
-        # So we get 0 for the bottom row of the image
-        for y in range(imageHeight - 1, -1, -1):
-            for x in range(imageWidth):
-                pixelHeight = calculatePixelHeight(image, x, y, baseHeight, maximumHeight)
+    return (PointGrid(heights, pixelSize), heightmap.maximumHeight(heights))
 
-                if pixelHeight > maxHeight:
-                    maxHeight = pixelHeight
+def averageByNozzleSize(pointGrid, nozzleSize, areaWeighted=False):
+    '''Average the heights of all the points a single nozzle width covers.
+    By default nozzleSize is rounded to a whole number of points. With areaWeighted the points
+    are resampled to exactly nozzleSize and points on the border of a cell count only partly.'''
+    cellSize, areaWeighted = heightmap.averagingCellSize(pointGrid.spacing, nozzleSize, areaWeighted)
 
-                pts.append(FreeCAD.Vector(x * pixelSize, (imageHeight - (y + 1)) * pixelSize, pixelHeight))
+    if cellSize == 1:
+        return pointGrid
 
-        lines = pointCloudToLines(pts)
+    if areaWeighted:
+        heights = heightmap.areaWeightedAverage(pointGrid.heights, cellSize)
 
-        return (lines, maxHeight)
+        return pointGrid.withHeights(heights, nozzleSize)
 
-def averageByNozzleSize(lines, ppi, nozzleSize):
-    if nozzleSize == 0:
-        return lines
-    
-    reducedLines = []
-    pixelSize = mmPerPixel(ppi)
-    numberOfPointsToReduce = int(round((nozzleSize.Value / pixelSize)))
+    heights = heightmap.blockAverage(pointGrid.heights, cellSize)
+
+    return pointGrid.withHeights(heights, pointGrid.spacing * cellSize)
+
+def computeTiledPointGrid(imageData, imageScale, pixelSize, heightTable, nozzleSize, areaWeighted, tileSize):
+    '''Does the same as computePointGrid followed by averageByNozzleSize. But the image is decoded and
+    averaged in bands of about tileSize lines. So only the averaged heights of the whole image are kept in memory.
+    Formats that can't decode a part of the image are decoded once, only the heights are computed in bands.'''
+    width, height = qtutils.imageDataSize(imageData, imageScale)
+    cellSize, areaWeighted = heightmap.averagingCellSize(pixelSize, nozzleSize, areaWeighted)
+
+    # All bands are read from the same copy of the data
+    buffer = qtutils.imageDataBuffer(imageData)
+
+    # Without clip rect support every band would decode the whole image. So it is decoded only once
+    image = None if qtutils.supportsClipRect(imageData, imageScale) else qtutils.readImageBuffer(buffer, imageScale)
+
+    def readBand(firstLine, endLine):
+        # Line 0 is the bottom row of the image
+        clipRect = (0, height - endLine, width, endLine - firstLine)
+
+        if image is None:
+            bandImage = qtutils.readImageBuffer(buffer, imageScale, clipRect)
+        else:
+            bandImage = image.copy(*clipRect)
+
+        return computeHeights(bandImage, heightTable)[::-1]
+
+    cellsPerBand = max(1, int(tileSize / cellSize))
+    heights, maxHeight = heightmap.averageInBands(height, cellSize, areaWeighted, cellsPerBand, readBand)
+
+    if areaWeighted:
+        return (PointGrid(heights, nozzleSize), maxHeight)
+
+    return (PointGrid(heights, pixelSize * cellSize), maxHeight)
+
+def computeParallelPointGrid(pool, image, pixelSize, heightTable, nozzleSize, areaWeighted):
+    '''Does the same as computePointGrid followed by averageByNozzleSize. But bands of lines are
+    computed in the processes of the pool. The bands start at nozzle block borders, so the result is exactly the same.
+    Without a pool or when the processes don't finish in time, it is computed in this process.'''
+    if pool is None:
+        return computeSerialPointGrid(image, pixelSize, heightTable, nozzleSize, areaWeighted)
+
+    argb = qtutils.imageToArgbArray(image)
+    height = argb.shape[0]
+
+    cellSize, areaWeighted = heightmap.averagingCellSize(pixelSize, nozzleSize, areaWeighted)
+
+    # Some bands more than processes, so all processes have something to do until the end
+    numberOfCells = len(heightmap.cellBounds(height, cellSize)[0])
+    cellsPerBand = max(1, int(math.ceil(numberOfCells / (worker_pool.numberOfProcesses() * 4))))
+
+    with worker_pool.SharedArray(argb) as sharedImage:
+        del argb
 
-    for linesToCombine in toChunks(lines, numberOfPointsToReduce):
-        combined = []
+        tasks = [(sharedImage.name, sharedImage.shape, band, cellSize, areaWeighted, heightTable, qtutils.lightnessTable())
+                 for band in heightmap.averagingBands(height, cellSize, cellsPerBand)]
 
-        for line in linesToCombine:
-            for index, rowsToCombine in enumerate(toChunks(line, numberOfPointsToReduce)):
-                if len(combined) < index + 1:
-                    combined.append(AverageVector())
+        bandResults = worker_pool.mapTasks(pool, heightmap.averageSharedBand, tasks)
 
-                for point in rowsToCombine:
-                    combined[index].add(point)
+    if bandResults is None:
+        return computeSerialPointGrid(image, pixelSize, heightTable, nozzleSize, areaWeighted)
 
-                del rowsToCombine
+    heights, maxHeight = heightmap.stitchBands(bandResults)
 
-        reducedLines.append([vector.average() for vector in combined])
-        del linesToCombine
+    if areaWeighted:
+        return (PointGrid(heights, nozzleSize), maxHeight)
 
+    return (PointGrid(heights, pixelSize * cellSize), maxHeight)
 
-    return reducedLines
+def computeSerialPointGrid(image, pixelSize, heightTable, nozzleSize, areaWeighted):
+    pointGrid, maxHeight = computePointGrid(image, pixelSize, heightTable)
 
-def nearestLayerHeight(lines, layerHeight):
+    return (averageByNozzleSize(pointGrid, nozzleSize, areaWeighted), maxHeight)
+
+def nearestLayerHeight(pointGrid, layerHeight):
+    '''Rounds the heights of the grid in place to the nearest layer height'''
     if layerHeight == 0:
-        return lines
+        return pointGrid
     
-    roundedLines = []
-    tolerance = 0.0001
+    pointGrid.numberOfLayers = heightmap.roundToLayerHeight(pointGrid.heights, layerHeight)
 
-    for line in lines:
-        roundedLine = []
+    return pointGrid
 
-        for point in line:
-            mod = point.z % layerHeight
-            reversedMod = layerHeight - mod
+class LithophaneImage(BaseLithophaneProcessor):
+    # Content of the image file and its hash. The image is decoded from the data when it is accessed
+    imageData = None
+    imageHash = None
+    loadedImage = None
 
-            if mod > tolerance:
-                roundedZ = None
+    # Hash of the decoded pixels. Keys the heightmaps cached on disk
+    pixelHash = None
 
-                if reversedMod < mod:
-                    roundedZ = point.z + reversedMod
-                else:
-                    roundedZ = point.z - mod
-                
-                roundedLine.append(FreeCAD.Vector(point.x, point.y, roundedZ))
-            else:
-                roundedLine.append(point)
-        
-        roundedLines.append(roundedLine)
+    # The image is decoded to 1 / imageScale of its size
+    imageScale = 1
 
-    return roundedLines
+    # In tiled mode the image is processed in bands of lines. Only a preview of the image is decoded at once
+    tiled = False
+
+    # Bands of lines are computed in worker processes
+    parallel = False
+
+    # Serialized grid of a restored document. It is only decoded when it is accessed
+    restoredGrid = None
 
-class LithophaneImage(BaseLithophaneProcessor):
     def __init__(self, obj, imagePath):
         '''Add properties for image like path'''
         super(LithophaneImage, self).__init__('Recalculate Image')
@@ -188,12 +265,55 @@ class LithophaneImage(BaseLithophaneProcessor):
         obj.addProperty("App::PropertyLength", "MaximumHeight", "LithophaneImage", "The height of the black color").MaximumHeight = 3
         
         obj.addProperty("App::PropertyFloat", "UpdateNotifier", "LithophaneImage", "Notifies the View Provider that something changed.").UpdateNotifier = -1
+
+        self.setProperties(obj)
         
         obj.Proxy = self
 
+        self.Object = obj
         self.lastPath = imagePath
         self.isLithophaneImage = True
 
+    def setProperties(self, obj):
+        '''Adds the properties that were introduced later, so that older documents get them too'''
+        pl = obj.PropertiesList
+
+        if not 'NozzleAveraging' in pl:
+            obj.addProperty("App::PropertyEnumeration", "NozzleAveraging", "LithophaneImage",
+                            "How pixels are combined to nozzle sized points. Area Weighted does not round the nozzle size to whole pixels")
+
+            obj.NozzleAveraging = ['Block', 'Area Weighted']
+
+        if not 'ExactDecode' in pl:
+            obj.addProperty("App::PropertyBool", "ExactDecode", "LithophaneImage",
+                            "Always decode the image in full size. Otherwise JPEG images are decoded directly to the nozzle size, which needs a lot less memory").ExactDecode = False
+
+        if not 'TiledProcessing' in pl:
+            obj.addProperty("App::PropertyBool", "TiledProcessing", "LithophaneImage",
+                            "Decode and average the image in bands of lines. Needed for images that are too big to be loaded at once").TiledProcessing = False
+
+        if not 'Gamma' in pl:
+            obj.addProperty("App::PropertyFloat", "Gamma", "Tone", "Gamma correction of the lightness. Values above 1 make mid tones lighter, values below 1 darker").Gamma = 1
+
+        if not 'Contrast' in pl:
+            obj.addProperty("App::PropertyFloat", "Contrast", "Tone", "Values above 1 increase the contrast of the lightness, values below 1 decrease it").Contrast = 1
+
+        if not 'ToneCurve' in pl:
+            obj.addProperty("App::PropertyVectorList", "ToneCurve", "Tone",
+                            "Control points of a curve that maps the lightness. x is the lightness of a pixel (0 - 255) and y the lightness it is mapped to. z is ignored")
+
+    def onDocumentRestored(self, obj):
+        self.Object = obj
+        self.setProperties(obj)
+
+        # Done here and not in __setstate__ because the image data might be stored by another image.
+        # It is taken right away, so the data stays when the image storing it is deleted
+        self.getImageData()
+
+        if not preferences.useLazyRestore():
+            self.image
+            self.pointGrid
+
     def getProcessingSteps(self, fp):
         return [('Reload Image', self.reloadImage), 
         ('Compute Point Cloud', self.computePointcloud), 
@@ -201,65 +321,301 @@ class LithophaneImage(BaseLithophaneProcessor):
         ('Compute Layer Height', self.computeLayerHeight)]
 
     def reloadImage(self, fp):
-        if imageChanged(self, fp.Path):
-            self.image = qtutils.readImage(fp.Path)
+        loaded = imageChanged(self, fp.Path)
+
+        if loaded:
+            self.imageHash, self.imageData = registerImageData(readImageFile(fp.Path))
+            self.loadedImage = None
             self.lastPath = fp.Path
 
-            imageSize = self.image.size()
-            self.imageHeight = imageSize.height()
-            self.imageWidth = imageSize.width()
+        imageScale = self.decodeScale(fp)
+
+        if imageScale != self.imageScale or fp.TiledProcessing != self.tiled:
+            self.imageScale = imageScale
+            self.tiled = fp.TiledProcessing
+            self.loadedImage = None
+            loaded = True
+
+        if loaded and self.tiled and not qtutils.supportsClipRect(self.getImageData(), self.imageScale):
+            FreeCAD.Console.PrintWarning('%s: Tiled Processing can not decode parts of this image format. The image is decoded in full size, so it needs as much memory as without tiles\n' % (fp.Label))
+
+        self.parallel = not self.tiled and worker_pool.getPool() is not None
+
+        self.stepKeys = self.computeStepKeys(fp)
+        self.diskCacheKey = None
+
+        if heightmap_cache.isEnabled():
+            self.diskCacheKey = heightmap_cache.cacheKey(self.computeImageHash(), self.stepParameters(fp))
+
+    def toneValues(self, fp):
+        '''The lightness every lightness value is mapped to by the tone properties'''
+        return heightmap.toneLightness(fp.Gamma, fp.Contrast, [(point.x, point.y) for point in fp.ToneCurve])
+
+    def heightTable(self, fp):
+        return heightmap.heightTable(fp.BaseHeight.Value, fp.MaximumHeight.Value, self.toneValues(fp))
+
+    def averagesInBands(self):
+        '''In tiled and parallel mode the point cloud step averages by nozzle size too'''
+        return self.tiled or self.parallel
+
+    def decodeScale(self, fp):
+        '''How many pixels in each direction are combined into one while decoding the image.
+        The pixels are averaged by nozzle size anyway, so we don't need to decode them in full size.
+        In Area Weighted mode only the whole number part of the nozzle size is decoded, the rest is averaged afterwards.'''
+        if fp.ExactDecode or fp.NozzleSize.Value == 0:
+            return 1
+
+        pointsPerNozzle = fp.NozzleSize.Value / mmPerPixel(fp.ppi)
+
+        if fp.NozzleAveraging == 'Area Weighted':
+            scale = int(pointsPerNozzle + 1e-6)
+        else:
+            scale = int(round(pointsPerNozzle))
+
+        if scale <= 1 or not qtutils.supportsScaledDecode(self.getImageData()):
+            return 1
+
+        return scale
+
+    def stepParameters(self, fp):
+        '''The properties the point cloud, nozzle size and layer height step depend on'''
+        toneParameters = (fp.Gamma, fp.Contrast, tuple((point.x, point.y) for point in fp.ToneCurve))
+        pointCloudParameters = (fp.ppi, self.imageScale, fp.BaseHeight.Value, fp.MaximumHeight.Value, toneParameters)
+        nozzleParameters = (fp.NozzleSize.Value, fp.NozzleAveraging)
+
+        if self.averagesInBands():
+            # The bands are averaged by nozzle size right after their heights are computed
+            pointCloudParameters += ('Bands',) + nozzleParameters
+
+        return [pointCloudParameters, nozzleParameters, (fp.LayerHeight.Value,)]
+
+    def computeStepKeys(self, fp):
+        '''The cache keys of the point cloud, nozzle size and layer height step.
+        Every key contains the key of the step before and the properties the step depends on.'''
+        stepKeys = []
+        key = (self.lastPath, self.image.cacheKey())
+
+        for parameters in self.stepParameters(fp):
+            key = (key, parameters)
+            stepKeys.append(key)
+
+        return stepKeys
+
+    def computeImageHash(self):
+        '''Hash of the pixel values. Only computed once for every loaded image.
+        In tiled mode the pixels are never decoded at once, so the hash of the image file is used.'''
+        if self.tiled:
+            return 'file:%s' % self.imageHash
+
+        imageKey = self.image.cacheKey()
+
+        if getattr(self, 'imageHashKey', None) != imageKey:
+            self.pixelHash = heightmap_cache.imageHash(qtutils.imageToArgbArray(self.image))
+            self.imageHashKey = imageKey
+
+        return self.pixelHash
+
+    def loadCachedHeightmap(self):
+        '''Puts the heightmap stored on disk into the step cache, so all the steps can be skipped'''
+        if self.diskCacheKey is None or stepCache().get(self.stepKeys[-1]) is not None:
+            return
+
+        self.diskCacheResult = heightmap_cache.load(self.diskCacheKey)
+
+        if self.diskCacheResult is not None:
+            stepCache().put(self.stepKeys[-1], self.diskCacheResult)
+
+    def cachedStep(self, stepIndex, computeStep):
+        '''Returns the cached result of the step or computes it.
+        When the result of a later step is cached already, it is returned instead. So all the steps in between are skipped.'''
+        cache = stepCache()
+
+        for key in reversed(self.stepKeys[stepIndex:]):
+            result = cache.get(key)
+
+            if result is not None:
+                return result
+
+        # Might not fit into the step cache
+        if self.diskCacheResult is not None:
+            return self.diskCacheResult
+
+        result = computeStep()
+        cache.put(self.stepKeys[stepIndex], result)
+
+        self.computedSteps.append(stepIndex)
+
+        return result
     
     def computePointcloud(self, fp):
-        return computeLines(self.image, fp.ppi, fp.BaseHeight, fp.MaximumHeight)
+        self.diskCacheResult = None
+        self.computedSteps = []
+        self.loadCachedHeightmap()
+
+        pixelSize = mmPerPixel(fp.ppi) * self.imageScale
+        areaWeighted = fp.NozzleAveraging == 'Area Weighted'
+
+        if self.tiled:
+            return self.cachedStep(0, lambda: computeTiledPointGrid(self.getImageData(), self.imageScale, pixelSize, self.heightTable(fp),
+                                                                    fp.NozzleSize.Value, areaWeighted, preferences.getTileSize()))
+
+        if self.parallel:
+            return self.cachedStep(0, lambda: computeParallelPointGrid(worker_pool.getPool(), self.image, pixelSize, self.heightTable(fp),
+                                                                       fp.NozzleSize.Value, areaWeighted))
+
+        return self.cachedStep(0, lambda: computePointGrid(self.image, pixelSize, self.heightTable(fp)))
     
     def computeNozzleSize(self, fp, pointData):
-        return (averageByNozzleSize(pointData[0], fp.ppi, fp.NozzleSize), pointData[1])
+        if self.averagesInBands():
+            # Averaged while the point cloud was computed
+            return pointData
+
+        areaWeighted = fp.NozzleAveraging == 'Area Weighted'
+
+        return self.cachedStep(1, lambda: (averageByNozzleSize(pointData[0], fp.NozzleSize.Value, areaWeighted), pointData[1]))
     
     def computeLayerHeight(self, fp, lineData):
-        return (nearestLayerHeight(lineData[0], fp.LayerHeight.Value), lineData[1])
+        # The grid of the step before is cached. So we have to round a copy
+        result = self.cachedStep(2, lambda: (nearestLayerHeight(lineData[0].copy(), fp.LayerHeight.Value), lineData[1]))
+
+        # Only worth a file when the expensive steps ran. Changing only the layer height is fast anyway
+        if self.diskCacheKey is not None and any(stepIndex < 2 for stepIndex in self.computedSteps):
+            heightmap_cache.store(self.diskCacheKey, result)
+
+        return result
     
     def processingDone(self, fp, lineData):
-        self.lines = lineData[0]
+        self.pointGrid = lineData[0]
         self.maxHeight = lineData[1]
 
         fp.UpdateNotifier += 1
 
-    def length(self):
-        return self.lines[-1][-1].x
+    @property
+    def image(self):
+        if self.loadedImage is None:
+            self.image = qtutils.readImageData(self.getImageData(), self.displayScale())
 
-    def width(self):
-        return self.lines[-1][-1].y
+        return self.loadedImage
 
-    def __getstate__(self):
-        '''Store the image as base64 inside the document'''
+    @image.setter
+    def image(self, image):
+        self.loadedImage = image
 
-        base64ImageOriginal = imgToBase64(self.image)
+        imageSize = image.size()
+        self.imageHeight = imageSize.height()
+        self.imageWidth = imageSize.width()
 
-        lineTuples = []
+    def displayScale(self):
+        '''The scale the image is decoded with. In tiled mode it is decoded small enough to be shown'''
+        if not self.tiled:
+            return self.imageScale
 
-        for line in self.lines:
-            lineTuples.append([vectorToTuple(point) for point in line])
-       
-        return (base64ImageOriginal, self.lastPath, lineTuples, self.maxHeight)
- 
-    def __setstate__(self,state):
-        '''Restore the state'''
+        width, height = qtutils.imageDataSize(self.getImageData())
 
-        super(LithophaneImage, self).__init__('Recalculate Image')
+        return max(self.imageScale, int(math.ceil(max(width, height) / PREVIEW_SIZE)))
 
-        base64ImageOriginal = state[0]
+    def getImageData(self):
+        '''The content of the image file. Images that do not store the data themselves get it from the image that does'''
+        if self.imageData is None:
+            self.imageData = IMAGE_DATA[self.imageHash]
 
-        self.image = imageFromBase64(base64ImageOriginal)
-        self.lastPath = state[1]
-        self.lines = []
-        self.maxHeight = state[3]
+        return self.imageData.data
 
-        for line in state[2]:
-            self.lines.append([tupleToVector(point) for point in line])
+    def ownsImageData(self):
+        '''Only the first image (by name) with the same content stores the image data in the document'''
+        sameImages = [o.Name for o in self.Object.Document.Objects
+                      if getattr(getattr(o, 'Proxy', None), 'isLithophaneImage', False) and o.Proxy.imageHash == self.imageHash]
 
-        imageSize = self.image.size()
-        self.imageHeight = imageSize.height()
-        self.imageWidth = imageSize.width()
+        return not sameImages or min(sameImages) == self.Object.Name
+
+    @property
+    def pointGrid(self):
+        if isinstance(self.restoredGrid, dict):
+            self.pointGrid = gridFromState(self.restoredGrid)
+        elif self.restoredGrid is not None:
+            # Documents saved before version 2 contain a (x, y, z) tuple for every point
+            self.pointGrid = PointGrid.fromLines(self.restoredGrid)
+
+        return self.loadedPointGrid
+
+    @pointGrid.setter
+    def pointGrid(self, pointGrid):
+        self.loadedPointGrid = pointGrid
+        self.restoredGrid = None
+
+    def isImageLoaded(self):
+        return self.loadedImage is not None
+
+    @property
+    def lines(self):
+        '''The points as list of lines. Each line is a list of FreeCAD.Vector, created when accessed'''
+        return self.pointGrid.lines
+
+    def length(self):
+        if isinstance(self.restoredGrid, dict):
+            return gridExtentFromState(self.restoredGrid)[0]
+
+        return self.pointGrid.length()
+
+    def width(self):
+        if isinstance(self.restoredGrid, dict):
+            return gridExtentFromState(self.restoredGrid)[1]
+
+        return self.pointGrid.width()
+
+    def __getstate__(self):
+        '''Store the original image file and the point grid as compressed binary data inside the document.
+        Data that was never accessed after the document was opened is written back as it is.'''
+
+        if isinstance(self.restoredGrid, dict):
+            gridState = self.restoredGrid
+        else:
+            gridState = gridToState(self.pointGrid)
+
+        state = {
+            'version': STATE_VERSION,
+            'imageHash': self.imageHash,
+            'imageScale': self.imageScale,
+            'tiled': self.tiled,
+            'path': self.lastPath,
+            'grid': gridState,
+            'maxHeight': self.maxHeight
+        }
+
+        if self.ownsImageData():
+            state['imageData'] = base64.b64encode(self.getImageData()).decode('ascii')
+
+        return state
+ 
+    def __setstate__(self,state):
+        '''Restore the state. The image and point grid are decoded when they are accessed the first time'''
+
+        super(LithophaneImage, self).__init__('Recalculate Image')
+
+        self.loadedImage = None
+        self.imageData = None
+        self.imageScale = 1
+        self.tiled = False
+
+        if isinstance(state, dict):
+            self.lastPath = state['path']
+            self.restoredGrid = state['grid']
+            self.maxHeight = state['maxHeight']
+            self.imageScale = state.get('imageScale', 1)
+            self.tiled = state.get('tiled', False)
+
+            if 'imageData' in state:
+                self.imageHash, self.imageData = registerImageData(base64.b64decode(state['imageData'].encode('ascii')))
+            elif 'imageHash' in state:
+                self.imageHash = state['imageHash']
+            else:
+                # Documents saved before version 3 contain the image as base64 encoded PNG
+                self.imageHash, self.imageData = registerImageData(base64.b64decode(state['image'].encode('ascii')))
+        else:
+            self.imageHash, self.imageData = registerImageData(base64.b64decode(state[0].encode('ascii')))
+            self.lastPath = state[1]
+            self.restoredGrid = state[2]
+            self.maxHeight = state[3]
 
         self.isLithophaneImage = True
         
@@ -310,6 +666,16 @@ class ViewProviderLithophaneImage:
 
         vobj.addDisplayMode(self.imageNode, "LithophaneImage");
 
+        self.textureOutdated = True
+        self.setProperties(vobj)
+
+    def setProperties(self, vobj):
+        pl = vobj.PropertiesList
+
+        if not 'FullResolutionTexture' in pl:
+            vobj.addProperty("App::PropertyBool", "FullResolutionTexture", "LithophaneImage",
+                             "Show the image in full resolution. Otherwise it is scaled down to the PreviewTextureSize preference").FullResolutionTexture = False
+
     def getDisplayModes(self,obj):
         '''Return a list of display modes.'''
         
@@ -321,13 +687,11 @@ class ViewProviderLithophaneImage:
         return "LithophaneImage"
 
     def updateData(self, fp, prop):
-        '''Nothing to do when some properties are changed'''
+        '''Update the size and texture of the image when it was recomputed'''
         
         if prop == 'UpdateNotifier' and self.Object.UpdateNotifier > -1:
             lithophaneImage = self.LithophaneImage
 
-            self.texture.image = convertImageToTexture(lithophaneImage.image)
-
             length = lithophaneImage.length()
             width = lithophaneImage.width()
             
@@ -335,11 +699,43 @@ class ViewProviderLithophaneImage:
             self.coords.point.set1Value(2, length, width, -1)
             self.coords.point.set1Value(3, 0, width, -1)
 
+            self.textureOutdated = True
+
+            if not self.ViewObject.Visibility:
+                # Will be updated when the image is shown
+                return
+
+            if lithophaneImage.isImageLoaded():
+                self.updateTexture()
+            else:
+                # Don't decode the image of a restored document while the document is opened
+                qtutils.QTimer.singleShot(0, self.updateTexture)
+
         return
+
+    def updateTexture(self):
+        if not self.textureOutdated:
+            return
+
+        if self.ViewObject.FullResolutionTexture:
+            maximumSize = 0
+        else:
+            maximumSize = preferences.getPreviewTextureSize()
+
+        toneValues = self.LithophaneImage.toneValues(self.Object)
+
+        self.texture.image = convertImageToTexture(self.LithophaneImage.image, maximumSize, toneValues)
+        self.textureOutdated = False
  
     def onChanged(self, vp, prop):
-        '''Nothing to do on change now'''
-        return
+        if prop == 'FullResolutionTexture' and hasattr(self, 'texture'):
+            self.textureOutdated = True
+
+            if vp.Visibility:
+                self.updateTexture()
+
+        if prop == 'Visibility' and vp.Visibility and getattr(self, 'textureOutdated', False):
+            self.updateTexture()
 
     def doubleClicked(self,vobj):
         ImageViewer(self.LithophaneImage.image)
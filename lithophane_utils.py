@@ -2,10 +2,16 @@ import sys
 IS_PY_2 = sys.version_info.major < 3
 
 import math
+import numpy
 import FreeCAD, FreeCADGui
 import itertools, Mesh
 from pivy import coin
 import utils.qtutils as qtutils
+from utils import heightmap
+from utils.cache import LRUCache
+
+# Texture bytes of the images shown in the 3D view. Keyed by QImage.cacheKey()
+TEXTURE_CACHE = LRUCache(128 * 1024 * 1024, lambda texture: len(texture[2]))
 
 def recomputeView():
     FreeCAD.ActiveDocument.recompute()
@@ -117,44 +123,49 @@ def toChunks(iterable, chunksize):
         
         yield wrapped_chunk.pop()
 
+def meshFromArrays(points, facets):
+    '''Creates a mesh from a (N, 3) array of points and a (M, 3) array of point indices.
+    Every point is stored only once, so there are no duplicated points to remove afterwards.'''
+    return Mesh.Mesh(([tuple(point) for point in points.tolist()], [tuple(facet) for facet in facets.tolist()]))
+
+def meshToArrays(mesh):
+    '''The (N, 3) array of points and the (M, 3) array of point indices of the mesh'''
+    points, facets = mesh.Topology
+
+    return (numpy.array([vectorToTuple(point) for point in points], dtype=numpy.float64).reshape(-1, 3),
+            numpy.array(facets, dtype=numpy.intp).reshape(-1, 3))
+
 def vectorToTuple(vector):
   return (vector.x, vector.y, vector.z)
 
 def tupleToVector(t):
   return FreeCAD.Vector(t[0], t[1], t[2])
 
-def convertImageToTexture(image):
-    size = coin.SbVec2s(image.width(), image.height())
-    buffersize = image.byteCount()
+def convertImageToTexture(image, maximumSize=0, toneValues=None):
+    '''Creates a grayscale texture of the image. When maximumSize is set and the image is larger,
+    it is scaled down so that the texture is at most maximumSize pixels wide and high.
+    toneValues are the mapped lightness values of heightmap.toneLightness. So the texture shows the tone mapping.'''
+    blockSize = 1
 
-    soImage = coin.SoSFImage()
-    width = size[0]
-    height = size[1]
-    # imageBytes = b''
+    if maximumSize > 0:
+        blockSize = max(1, int(math.ceil(max(image.width(), image.height()) / float(maximumSize))))
 
-    byteList = []
-    
-    for y in range(height -1, -1, -1):
-          for x in range(width):
-              
-              rgb = image.pixel(x,y)
-              color = qtutils.QColor()
-              color.setRgba(rgb)
-              alpha = color.alpha()
-              value = 0
-
-              if alpha < 255:
-                  value = 254 - alpha
-              else:
-                  value = color.lightness()
-              
-              if IS_PY_2:
-                  byteList.append(chr(value))
-              else:
-                  byteList.append(chr(value).encode('latin-1'))
-
-    imageBytes = b''.join(byteList)
-    soImage.setValue(size, 1, imageBytes)
+    key = (image.cacheKey(), blockSize, None if toneValues is None else toneValues.tobytes())
+    texture = TEXTURE_CACHE.get(key)
+
+    if texture is None:
+        # Scaling the image first keeps the arrays small. Smooth scaling averages the pixels of every block
+        if blockSize > 1:
+            image = image.scaled(qtutils.QSize(*qtutils.scaledSize(image.size(), blockSize)),
+                                 qtutils.Qt.IgnoreAspectRatio, qtutils.Qt.SmoothTransformation)
+
+        values = heightmap.textureValues(qtutils.imageToArgbArray(image), qtutils.lightnessTable(), toneValues)
+
+        texture = (values.shape[1], values.shape[0], values.tobytes())
+        TEXTURE_CACHE.put(key, texture)
+
+    soImage = coin.SoSFImage()
+    soImage.setValue(coin.SbVec2s(texture[0], texture[1]), 1, texture[2])
 
     return soImage
 
@@ -2,13 +2,12 @@ import FreeCAD, FreeCADGui
 import Points
 
 import lithophane_utils
-from utils.geometry_utils import linesToPointCloud
 from utils.resource_utils import iconPath
 import utils.qtutils as qtutils
 
-def showPointCloud(pts, name):
+def showPointCloud(pointGrid, name):
     pointCloud = Points.Points()
-    pointCloud.addPoints(linesToPointCloud(pts))
+    pointCloud.addPoints([tuple(point) for point in pointGrid.points().tolist()])
 
     Points.show(pointCloud, name)
 
@@ -29,7 +28,7 @@ class ShowPointCloudCommand:
 
           return
         
-        showPointCloud(lithophaneImage.lines, imageLabel + '_PointCloud')
+        showPointCloud(lithophaneImage.pointGrid, imageLabel + '_PointCloud')
 
         lithophane_utils.recomputeView()
     
@@ -0,0 +1,69 @@
+'''A least recently used cache that is bounded by the size of its entries'''
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    '''Keeps the most recently used entries as long as their overall size is below maximumSize.
+    sizeOf is called once for every entry and must return its size (e.g. in bytes).'''
+
+    def __init__(self, maximumSize, sizeOf):
+        self.maximumSize = maximumSize
+        self.sizeOf = sizeOf
+        self.size = 0
+        self.entries = OrderedDict()
+
+        # Processing steps run in a worker thread
+        self.lock = threading.RLock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.entries:
+                return default
+
+            entry = self.entries.pop(key)
+            self.entries[key] = entry
+
+            return entry[0]
+
+    def put(self, key, value):
+        entrySize = self.sizeOf(value)
+
+        with self.lock:
+            self.remove(key)
+
+            # Would evict everything else and still not fit
+            if entrySize > self.maximumSize:
+                return
+
+            self.entries[key] = (value, entrySize)
+            self.size += entrySize
+
+            self.evict()
+
+    def remove(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+
+    def resize(self, maximumSize):
+        with self.lock:
+            self.maximumSize = maximumSize
+
+            self.evict()
+
+    def evict(self):
+        with self.lock:
+            while self.size > self.maximumSize and len(self.entries) > 0:
+                self.size -= self.entries.popitem(last=False)[1][1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
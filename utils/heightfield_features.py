@@ -0,0 +1,157 @@
+'''Applies boolean features that are vertical extrusions directly to the heights of a box lithophane.
+
+A vertical extrusion is a mesh that only has horizontal facets at its bottom and top and vertical facets in between.
+So it is described by its z range and the footprint of its top facets. Such features are rasterized into the
+heights of the grid points and the cells of the grid that are cut away, without any boolean operation on meshes.
+
+Everything in here works on numpy arrays only and does not depend on FreeCAD.
+'''
+import numpy
+
+
+class NotAHeightfield(Exception):
+    '''Raised when a feature can not be expressed by the heights of the grid'''
+    pass
+
+
+def extrusionOfMesh(points, facets, tolerance):
+    '''(bottom, top, triangles) of a mesh that is a vertical extrusion. triangles is a (N, 3, 2) array of the
+    x and y coordinates of the top facets. Raises NotAHeightfield for all other meshes.'''
+    corners = points[facets]
+    normals = numpy.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    lengths = numpy.linalg.norm(normals, axis=1)
+
+    # Facets without an area do not change the shape
+    valid = lengths > 0
+    corners = corners[valid]
+    normalZ = normals[valid, 2] / lengths[valid]
+
+    horizontal = numpy.abs(normalZ) >= 1 - 1e-6
+    vertical = numpy.abs(normalZ) <= 1e-6
+
+    if len(corners) == 0 or not (horizontal | vertical).all():
+        raise NotAHeightfield('it is not a vertical extrusion')
+
+    bottom = points[:, 2].min()
+    top = points[:, 2].max()
+
+    heights = corners[horizontal, :, 2]
+    atBottom = (numpy.abs(heights - bottom) <= tolerance).all(axis=1)
+    atTop = (numpy.abs(heights - top) <= tolerance).all(axis=1)
+
+    if not (atBottom | atTop).all() or not atTop.any():
+        raise NotAHeightfield('it has horizontal faces between its bottom and top')
+
+    return (bottom, top, corners[horizontal][atTop][:, :, :2])
+
+def insideTriangles(triangles, xCoordinates, yCoordinates, tolerance):
+    '''Marks the points of the grid that are inside or on the border of one of the (N, 3, 2) triangles'''
+    inside = numpy.zeros((len(yCoordinates), len(xCoordinates)), dtype=bool)
+
+    for a, b, c in triangles:
+        xMin, yMin = numpy.minimum(numpy.minimum(a, b), c) - tolerance
+        xMax, yMax = numpy.maximum(numpy.maximum(a, b), c) + tolerance
+
+        firstRow, endRow = numpy.searchsorted(xCoordinates, (xMin, xMax), 'left')
+        firstLine, endLine = numpy.searchsorted(yCoordinates, (yMin, yMax), 'left')
+
+        # Only the points in the bounding box of the triangle are tested
+        x, y = numpy.meshgrid(xCoordinates[firstRow:endRow + 1], yCoordinates[firstLine:endLine + 1])
+
+        if x.size == 0:
+            continue
+
+        area = (b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0])
+        sign = 1 if area > 0 else -1
+
+        # Distance of every point from the edges. Positive on the inner side of an edge
+        insideOfAll = numpy.ones(x.shape, dtype=bool)
+
+        for start, end in ((a, b), (b, c), (c, a)):
+            edge = end - start
+            cross = (edge[0] * (y - start[1]) - edge[1] * (x - start[0])) * sign
+            insideOfAll &= cross >= -tolerance * numpy.hypot(edge[0], edge[1])
+
+        inside[firstLine:endLine + 1, firstRow:endRow + 1] |= insideOfAll
+
+    return inside
+
+def cellCenters(coordinates):
+    return (coordinates[:-1] + coordinates[1:]) / 2
+
+def applyExtrusion(heights, removedCells, extrusion, mode, xCoordinates, yCoordinates, tolerance):
+    '''Applies an extrusion to the heights of the grid points and the cells that are cut away.
+    Additive extrusions standing on the ground raise the points to the top of the extrusion.
+    Subtractive extrusions reaching above the image lower the points to their bottom, or remove
+    the cells when they go through the whole lithophane.
+    Returns new (heights, removedCells) arrays. Raises NotAHeightfield when the result is not a heightfield.'''
+    bottom, top, triangles = extrusion
+
+    if (triangles[:, :, 0].min() < xCoordinates[0] - tolerance or triangles[:, :, 0].max() > xCoordinates[-1] + tolerance or
+            triangles[:, :, 1].min() < yCoordinates[0] - tolerance or triangles[:, :, 1].max() > yCoordinates[-1] + tolerance):
+        raise NotAHeightfield('it is not completely inside the image')
+
+    points = insideTriangles(triangles, xCoordinates, yCoordinates, tolerance)
+    cells = insideTriangles(triangles, cellCenters(xCoordinates), cellCenters(yCoordinates), tolerance)
+
+    heights = heights.copy()
+    removedCells = removedCells.copy()
+
+    # The points of removed cells are at the ground
+    cellHeights = numpy.maximum.reduce((heights[:-1, :-1], heights[:-1, 1:], heights[1:, :-1], heights[1:, 1:]))
+    cellHeights[removedCells] = 0
+
+    if mode == 'Additive':
+        # Features between the points would not change the heights and get lost
+        if not points.any():
+            raise NotAHeightfield('it does not contain any point of the image')
+
+        lowestPoint = min(heights[points].min(), cellHeights[cells].min() if cells.any() else numpy.inf)
+
+        if bottom < -tolerance or bottom > lowestPoint + tolerance:
+            raise NotAHeightfield('it does not stand on the ground')
+
+        heights[points] = numpy.maximum(heights[points], top)
+        removedCells[cells] = False
+
+        # Filling some of the removed cells can leave others that only touch at a corner
+        return (heights, keepManifold(removedCells))
+
+    highestPoint = max(heights[points].max() if points.any() else 0, cellHeights[cells].max() if cells.any() else 0)
+
+    if top < highestPoint - tolerance:
+        raise NotAHeightfield('it does not reach the top of the image')
+
+    if bottom <= tolerance:
+        if not cells.any():
+            raise NotAHeightfield('it does not contain the center of any cell of the image')
+
+        removedCells[cells] = True
+    else:
+        if not points.any():
+            raise NotAHeightfield('it does not contain any point of the image')
+
+        heights[points] = numpy.minimum(heights[points], bottom)
+
+    return (heights, keepManifold(removedCells))
+
+def keepManifold(removedCells):
+    '''Keeps the removed cells that only touch other removed cells at a corner, where two kept cells touch each other.
+    Otherwise the walls of both kept cells would share the same edge.'''
+    removedCells = removedCells.copy()
+
+    while True:
+        kept = ~removedCells
+        bottomLeft, bottomRight = kept[:-1, :-1], kept[:-1, 1:]
+        topLeft, topRight = kept[1:, :-1], kept[1:, 1:]
+
+        rising = bottomLeft & topRight & ~bottomRight & ~topLeft
+        falling = bottomRight & topLeft & ~bottomLeft & ~topRight
+
+        if not rising.any() and not falling.any():
+            return removedCells
+
+        removedCells[:-1, 1:][rising] = False
+        removedCells[1:, :-1][rising] = False
+        removedCells[:-1, :-1][falling] = False
+        removedCells[1:, 1:][falling] = False
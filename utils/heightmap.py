@@ -0,0 +1,310 @@
+'''Array based computations to turn image pixels into heights.
+
+Everything in here works on numpy arrays only and does not depend on FreeCAD or Qt.
+'''
+from __future__ import division
+
+import numpy
+
+
+def alphaChannel(argb):
+    return (argb >> 24) & 0xFF
+
+def lightness(argb, lightnessTable=None):
+    '''Computes the HSL lightness of every pixel. Lightness is (max + min) / 2 of the color components.
+
+    How QColor.lightness() rounds odd sums differs between Qt versions. So lightnessTable can hold the
+    lightness Qt calculates for every possible sum (0 to 510) to end up with the exact same values.
+    Without a table odd sums are rounded up.'''
+    red = ((argb >> 16) & 0xFF).astype(numpy.int32)
+    green = ((argb >> 8) & 0xFF).astype(numpy.int32)
+    blue = (argb & 0xFF).astype(numpy.int32)
+
+    componentSum = numpy.maximum(numpy.maximum(red, green), blue) + numpy.minimum(numpy.minimum(red, green), blue)
+
+    if lightnessTable is None:
+        return (componentSum + 1) // 2
+
+    return lightnessTable[componentSum]
+
+def pixelIndices(argb, lightnessTable=None):
+    '''Index of every pixel into a table built by heightTable or textureTable.
+    Opaque pixels use their lightness (0 to 255), transparent pixels 256 + their alpha value (0 to 254).'''
+    alpha = alphaChannel(argb)
+
+    return numpy.where(alpha < 255, 256 + alpha, lightness(argb, lightnessTable)).astype(numpy.uint16)
+
+def toneLightness(gamma=1, contrast=1, controlPoints=()):
+    '''The lightness every lightness value (0 to 255) is mapped to.
+    First the piecewise linear curve through the (lightness, mapped lightness) controlPoints is applied.
+    Then gamma (values above 1 make mid tones lighter) and contrast (values above 1 spread the values away from mid gray).'''
+    values = numpy.arange(256, dtype=numpy.float64)
+
+    if len(controlPoints) > 0:
+        points = sorted(controlPoints)
+        values = numpy.interp(values, [point[0] for point in points], [point[1] for point in points])
+
+    if gamma > 0 and gamma != 1:
+        values = 255 * (values / 255) ** (1 / gamma)
+
+    if contrast != 1:
+        values = (values - 127.5) * contrast + 127.5
+
+    return numpy.clip(values, 0, 255)
+
+def heightTable(baseHeight, maximumHeight, toneValues=None):
+    '''The height of every entry of the pixelIndices. Lighter colors mean lower height because the light must come through.
+    Maximum lightness 255 means the base height and lightness 0 the maximum height.
+    toneValues are the mapped lightness values returned by toneLightness.
+
+    For transparent pixels the alpha value is used. 254 means maximumHeight and 0 means baseHeight.'''
+    if toneValues is None:
+        toneValues = numpy.arange(256)
+
+    reversedLightness = 255 - toneValues  # Reverse the value. Lighter means lower height
+
+    percentage = numpy.concatenate(((100 / 255) * reversedLightness, (100 / 254) * numpy.arange(255)))
+
+    return baseHeight + ((maximumHeight - baseHeight) * percentage) / 100
+
+def pixelHeights(argb, heightTable, lightnessTable=None):
+    '''Looks up the height of every pixel in a table built by heightTable.
+    Does the same as lithophane_image.calculatePixelHeight but for the whole array at once.
+
+    Returns a float64 array with the same shape and row order as argb.
+    '''
+    return heightTable[pixelIndices(argb, lightnessTable)]
+
+def textureTable(toneValues=None):
+    '''The grayscale value of every entry of the pixelIndices.
+    Opaque pixels get their (mapped) lightness, transparent pixels 254 - alpha.'''
+    if toneValues is None:
+        toneValues = numpy.arange(256)
+
+    return numpy.concatenate((numpy.rint(toneValues), 254 - numpy.arange(255))).astype(numpy.uint8)
+
+def textureValues(argb, lightnessTable=None, toneValues=None):
+    '''The grayscale values of the texture that shows the image in the 3D view.
+    The rows are reversed, because the texture starts with the bottom row of the image.'''
+    return textureTable(toneValues)[pixelIndices(argb[::-1], lightnessTable)]
+
+def maximumHeight(heights):
+    '''The highest point of the heights but at least 0'''
+    if heights.size == 0:
+        return 0
+
+    return max(0, float(heights.max()))
+
+def blockAverage(heights, blockSize):
+    '''Replaces every block of blockSize x blockSize values with their average.
+    When the number of lines or rows is not a multiple of blockSize, the last block
+    is smaller and only averages the remaining values.'''
+    heights = numpy.asarray(heights, dtype=numpy.float64)
+
+    if heights.size == 0:
+        return heights
+
+    numberOfLines, numberOfRows = heights.shape
+
+    lineStarts = numpy.arange(0, numberOfLines, blockSize)
+    rowStarts = numpy.arange(0, numberOfRows, blockSize)
+
+    sums = numpy.add.reduceat(numpy.add.reduceat(heights, lineStarts, axis=0), rowStarts, axis=1)
+
+    lineCounts = numpy.diff(numpy.append(lineStarts, numberOfLines))
+    rowCounts = numpy.diff(numpy.append(rowStarts, numberOfRows))
+
+    return sums / numpy.outer(lineCounts, rowCounts)
+
+def cellBounds(count, cellSize):
+    '''Start and end of all cells with the given (possibly fractional) size that are needed to cover count values.
+    The last cell ends at count and might be smaller.'''
+    numberOfCells = int(numpy.ceil(count / cellSize - 1e-6))
+
+    starts = numpy.arange(numberOfCells) * cellSize
+    ends = numpy.minimum(starts + cellSize, count)
+
+    return (starts, ends)
+
+def areaWeightedCells(values, starts, ends, offset=0):
+    '''Averages the cells from starts to ends along the first axis of values. values[0] is at position offset.
+    A value that is only partly covered by a cell contributes with the covered fraction only.
+    Every cell is summed up on its own. So the average of a cell only depends on the values it covers
+    and not on the values before it.'''
+    shape = (-1,) + (1,) * (values.ndim - 1)
+
+    firstIndices = numpy.floor(starts).astype(numpy.intp)
+    lastIndices = numpy.ceil(ends).astype(numpy.intp) - 1
+
+    # Covered part of the first and last value of a cell
+    firstFractions = numpy.minimum(firstIndices + 1, ends) - starts
+    lastFractions = ends - lastIndices
+
+    firstIndices -= offset
+    lastIndices -= offset
+
+    sums = firstFractions.reshape(shape) * values[firstIndices]
+    sums += numpy.where((lastIndices > firstIndices).reshape(shape), lastFractions.reshape(shape) * values[lastIndices], 0)
+
+    # The whole values between the first and the last one. Every second reduceat result is the sum of a cell.
+    # A zero line is added so that a cell can end after the last value.
+    padded = numpy.concatenate((values, numpy.zeros((1,) + values.shape[1:])))
+    middleSums = numpy.add.reduceat(padded, numpy.column_stack((firstIndices + 1, lastIndices)).ravel(), axis=0)[::2]
+
+    sums += numpy.where((lastIndices > firstIndices + 1).reshape(shape), middleSums, 0)
+
+    return sums / (ends - starts).reshape(shape)
+
+def areaWeightedAverageAlongAxis(values, cellSize, axis):
+    '''Averages cells of cellSize values along the given axis. A value that is only partly
+    covered by a cell contributes with the covered fraction only.'''
+    values = numpy.moveaxis(numpy.asarray(values, dtype=numpy.float64), axis, 0)
+
+    starts, ends = cellBounds(values.shape[0], cellSize)
+
+    return numpy.moveaxis(areaWeightedCells(values, starts, ends), 0, axis)
+
+def areaWeightedAverage(heights, cellSize):
+    '''Resamples the heights to cells of cellSize x cellSize values. Unlike blockAverage the cell size
+    does not need to be a whole number. The last cell of a line or row might be smaller.'''
+    heights = numpy.asarray(heights, dtype=numpy.float64)
+
+    if heights.size == 0:
+        return heights
+
+    return areaWeightedAverageAlongAxis(areaWeightedAverageAlongAxis(heights, cellSize, 1), cellSize, 0)
+
+def averagingCellSize(spacing, nozzleSize, areaWeighted=False):
+    '''How many points in each direction are averaged into one nozzle sized point.
+    Returns (cellSize, areaWeighted). A cellSize of 1 means the points stay as they are.
+    areaWeighted is only True when the cell size is not a whole number.'''
+    if nozzleSize == 0:
+        return (1, False)
+
+    pointsPerNozzle = nozzleSize / spacing
+    numberOfPointsToReduce = int(round(pointsPerNozzle))
+
+    if areaWeighted and abs(pointsPerNozzle - numberOfPointsToReduce) > 1e-6:
+        if pointsPerNozzle <= 1:
+            return (1, False)
+
+        return (pointsPerNozzle, True)
+
+    if numberOfPointsToReduce <= 1:
+        return (1, False)
+
+    return (numberOfPointsToReduce, False)
+
+def averagingBands(count, cellSize, cellsPerBand):
+    '''Splits the cells that cover count lines into bands of cellsPerBand cells.
+    Returns (firstLine, endLine, firstCell, endCell) for every band. When the cell size is not a whole number
+    the last line of a band is partly covered by the first cell of the next band and is part of both bands.'''
+    starts, ends = cellBounds(count, cellSize)
+    bands = []
+
+    for firstCell in range(0, len(starts), cellsPerBand):
+        endCell = min(firstCell + cellsPerBand, len(starts))
+
+        firstLine = int(numpy.floor(starts[firstCell]))
+        endLine = int(numpy.ceil(ends[endCell - 1]))
+
+        bands.append((firstLine, endLine, firstCell, endCell))
+
+    return bands
+
+def averageBand(heights, count, cellSize, areaWeighted, band):
+    '''Averages the heights of one of the bands returned by averagingBands'''
+    firstLine, endLine, firstCell, endCell = band
+
+    # The heights are stored as float32 in a PointGrid before they are averaged
+    heights = numpy.asarray(heights, dtype=numpy.float32)
+
+    if cellSize == 1:
+        return heights
+
+    if areaWeighted:
+        starts, ends = cellBounds(count, cellSize)
+        heights = areaWeightedAverageAlongAxis(heights, cellSize, 1)
+
+        return areaWeightedCells(heights, starts[firstCell:endCell], ends[firstCell:endCell], firstLine)
+
+    return blockAverage(heights, cellSize)
+
+def averageInBands(count, cellSize, areaWeighted, cellsPerBand, readBand):
+    '''Does the same as blockAverage or areaWeightedAverage, but only needs a band of lines at once.
+    The bands start at cell borders. So the result is exactly the same as averaging all heights at once.
+
+    readBand(firstLine, endLine) has to return the heights of the lines. count is the number of lines of all bands.
+    Returns (averagedHeights, maximumHeight) where maximumHeight is the highest point of the heights before averaging.'''
+    bandResults = []
+
+    for band in averagingBands(count, cellSize, cellsPerBand):
+        heights = readBand(band[0], band[1])
+
+        bandResults.append((averageBand(heights, count, cellSize, areaWeighted, band), maximumHeight(heights)))
+
+    return stitchBands(bandResults)
+
+def stitchBands(bandResults):
+    '''Combines the (averagedHeights, maximumHeight) of all bands'''
+    return (numpy.concatenate([averaged for averaged, _ in bandResults]), max([0] + [highest for _, highest in bandResults]))
+
+def averageSharedBand(task):
+    '''Runs in a worker process. Computes and averages the heights of a band of an image in shared memory.
+    The image is a (height, width) array of ARGB values with the top row of the image first.'''
+    memoryName, shape, band, cellSize, areaWeighted, heightsOfPixels, lightnessTable = task
+    firstLine, endLine = band[0], band[1]
+
+    memory = attachSharedMemory(memoryName)
+
+    try:
+        argb = numpy.ndarray(shape, dtype=numpy.uint32, buffer=memory.buf)
+
+        # Line 0 is the bottom row of the image
+        heights = pixelHeights(argb[shape[0] - endLine:shape[0] - firstLine], heightsOfPixels, lightnessTable)[::-1]
+        result = (averageBand(heights, shape[0], cellSize, areaWeighted, band), maximumHeight(heights))
+
+        del argb
+    finally:
+        memory.close()
+
+    return result
+
+def checkWorker(value):
+    '''Runs in a worker process. Only returns the value. So the worker could import this module and numpy'''
+    return value
+
+def attachSharedMemory(name):
+    from multiprocessing import shared_memory
+
+    # The process that created the memory removes it
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13. The processes of the pool share the resource tracker of the process that
+        # created the memory. So it knows about the memory already.
+        return shared_memory.SharedMemory(name=name)
+
+def roundToLayerHeight(heights, layerHeight, tolerance=0.0001):
+    '''Rounds the heights in place to the nearest multiple of layerHeight.
+    Heights that are less than tolerance above a layer are left as they are.
+    When a height lies exactly between two layers it is rounded down.
+
+    Returns the number of distinct layers the heights end up in.'''
+    mod = numpy.mod(heights, layerHeight)
+    reversedMod = layerHeight - mod
+
+    needsRounding = mod > tolerance
+    roundUp = needsRounding & (reversedMod < mod)
+    roundDown = needsRounding & ~roundUp
+
+    numpy.add(heights, reversedMod, out=heights, where=roundUp)
+    numpy.subtract(heights, mod, out=heights, where=roundDown)
+
+    return numberOfLayers(heights, layerHeight)
+
+def numberOfLayers(heights, layerHeight):
+    if heights.size == 0:
+        return 0
+
+    return numpy.unique(numpy.rint(heights / layerHeight)).size
@@ -0,0 +1,134 @@
+'''Stores computed heightmaps on disk.
+So importing the same image with the same settings again does not need to compute the point cloud.'''
+import os
+import hashlib
+
+import numpy
+import FreeCAD
+
+from utils import preferences
+from utils.point_grid import PointGrid
+
+# Change this when the way the heightmap is computed changes. So old files are not used anymore
+CACHE_VERSION = 1
+
+
+def cacheDirectory():
+    return os.path.join(FreeCAD.getUserAppDataDir(), 'Lithophane', 'HeightmapCache')
+
+def isEnabled():
+    return preferences.useHeightmapCache()
+
+def imageHash(argb):
+    '''Hash of the pixel values of the image'''
+    pixels = numpy.ascontiguousarray(argb)
+
+    hasher = hashlib.sha1()
+    hasher.update(str(pixels.shape).encode('utf-8'))
+    hasher.update(pixels.data)
+
+    return hasher.hexdigest()
+
+def cacheKey(imageHash, parameters):
+    '''The key of a heightmap computed from the image with the given hash and a tuple of parameters'''
+    hasher = hashlib.sha1()
+    hasher.update(('%s|%s|%r' % (CACHE_VERSION, imageHash, parameters)).encode('utf-8'))
+
+    return hasher.hexdigest()
+
+def cacheFile(key):
+    return os.path.join(cacheDirectory(), key + '.npz')
+
+def load(key):
+    '''Returns the (PointGrid, maxHeight) stored for the key or None when nothing is stored'''
+    fileName = cacheFile(key)
+
+    if not os.path.exists(fileName):
+        return None
+
+    try:
+        with numpy.load(fileName) as data:
+            pointGrid = PointGrid(data['heights'], float(data['spacing']), tuple(data['origin']))
+
+            numberOfLayers = int(data['numberOfLayers'])
+            maxHeight = float(data['maxHeight'])
+    except Exception as e:
+        FreeCAD.Console.PrintWarning('Removing unreadable heightmap cache file %s: %s\n' % (fileName, e))
+        removeFile(fileName)
+
+        return None
+
+    if numberOfLayers >= 0:
+        pointGrid.numberOfLayers = numberOfLayers
+
+    # The modification time is used to find the least recently used files
+    os.utime(fileName, None)
+
+    return (pointGrid, maxHeight)
+
+def store(key, stepResult):
+    '''Writes the (PointGrid, maxHeight) for the key and removes old files when the cache gets too big'''
+    fileName = cacheFile(key)
+
+    if os.path.exists(fileName):
+        os.utime(fileName, None)
+
+        return
+
+    pointGrid, maxHeight = stepResult
+    numberOfLayers = pointGrid.numberOfLayers if pointGrid.numberOfLayers is not None else -1
+
+    directory = cacheDirectory()
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    # Write to a temporary file first. So other FreeCAD instances never read half written files
+    temporaryFile = '%s.%s.tmp' % (fileName, os.getpid())
+
+    try:
+        with open(temporaryFile, 'wb') as f:
+            numpy.savez_compressed(f, heights=pointGrid.heights, spacing=pointGrid.spacing, origin=pointGrid.origin,
+                                   numberOfLayers=numberOfLayers, maxHeight=maxHeight)
+
+        os.replace(temporaryFile, fileName)
+    except (IOError, OSError) as e:
+        FreeCAD.Console.PrintWarning('Could not write heightmap cache file %s: %s\n' % (fileName, e))
+        removeFile(temporaryFile)
+
+        return
+
+    evict(preferences.getHeightmapCacheSize() * 1024 * 1024)
+
+def evict(maximumSize):
+    '''Removes the least recently used files until all files together are smaller than maximumSize bytes'''
+    directory = cacheDirectory()
+
+    if not os.path.isdir(directory):
+        return
+
+    files = []
+
+    for name in os.listdir(directory):
+        if not name.endswith('.npz'):
+            continue
+
+        fileName = os.path.join(directory, name)
+        stat = os.stat(fileName)
+
+        files.append((stat.st_mtime, stat.st_size, fileName))
+
+    overallSize = sum(size for _, size, _ in files)
+
+    for _, size, fileName in sorted(files):
+        if overallSize <= maximumSize:
+            break
+
+        removeFile(fileName)
+        overallSize -= size
+
+def removeFile(fileName):
+    try:
+        os.remove(fileName)
+    except OSError:
+        pass
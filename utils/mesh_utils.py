@@ -0,0 +1,739 @@
+'''Builds meshes as vertex and triangle index arrays.
+
+The vertices are stored only once and the triangles reference them by index.
+Everything in here works on numpy arrays only and does not depend on FreeCAD.
+'''
+import numpy
+
+
+def gridVertices(xCoordinates, yCoordinates, heights):
+    '''All points of a grid as (numberOfLines * numberOfRows, 3) array.
+    Vertex line * numberOfRows + row is the point of the given line and row.'''
+    x, y = numpy.meshgrid(xCoordinates, yCoordinates)
+
+    return numpy.column_stack((x.ravel(), y.ravel(), numpy.ravel(heights)))
+
+def gridIndices(numberOfLines, numberOfRows, offset=0):
+    '''The vertex index of every point of a grid created with gridVertices. offset is the index of the first vertex.'''
+    return offset + numpy.arange(numberOfLines * numberOfRows).reshape(numberOfLines, numberOfRows)
+
+def gridFacets(indices):
+    '''Two triangles for every cell of a grid of vertex indices.
+    [bottomLeft, bottomRight, topLeft] and [bottomRight, topRight, topLeft] where the top is the next line.'''
+    bottomLeft = indices[:-1, :-1].ravel()
+    bottomRight = indices[:-1, 1:].ravel()
+    topRight = indices[1:, 1:].ravel()
+    topLeft = indices[1:, :-1].ravel()
+
+    return interleave(numpy.column_stack((bottomLeft, bottomRight, topLeft)),
+                      numpy.column_stack((bottomRight, topRight, topLeft)))
+
+def wallFacets(bottom, top):
+    '''Two triangles between every two neighbouring points of the bottom and top indices.
+    [bottom[i], bottom[i + 1], top[i]] and [bottom[i + 1], top[i + 1], top[i]]'''
+    return interleave(numpy.column_stack((bottom[:-1], bottom[1:], top[:-1])),
+                      numpy.column_stack((bottom[1:], top[1:], top[:-1])))
+
+def fanFacets(center, chain):
+    '''Triangles from the center vertex to every two neighbouring vertices of the chain.
+    [center, chain[i + 1], chain[i]]'''
+    return numpy.column_stack((numpy.full(len(chain) - 1, center), chain[1:], chain[:-1]))
+
+def interleave(first, second):
+    '''Combines two (N, 3) facet arrays so that the facets of both arrays alternate'''
+    return numpy.stack((first, second), axis=1).reshape(-1, 3)
+
+
+def mergedBlocks(heights, tolerance):
+    '''Merges the cells of a grid of heights bottom up into square blocks.
+    levels[k] marks the blocks of 2^k x 2^k cells whose four child blocks are merged and whose points
+    differ by at most tolerance. Level 0 are the single cells. Blocks that don't fit into the grid are never merged.'''
+    corners = (heights[:-1, :-1], heights[:-1, 1:], heights[1:, :-1], heights[1:, 1:])
+
+    maximum = numpy.maximum.reduce(corners)
+    minimum = numpy.minimum.reduce(corners)
+    merged = numpy.ones(maximum.shape, dtype=bool)
+
+    levels = [merged]
+
+    while merged.shape[0] >= 2 and merged.shape[1] >= 2:
+        lines = merged.shape[0] // 2 * 2
+        rows = merged.shape[1] // 2 * 2
+
+        children = [(slice(line, lines, 2), slice(row, rows, 2)) for line in (0, 1) for row in (0, 1)]
+
+        maximum = numpy.maximum.reduce([maximum[child] for child in children])
+        minimum = numpy.minimum.reduce([minimum[child] for child in children])
+        merged = numpy.logical_and.reduce([merged[child] for child in children]) & (maximum - minimum <= tolerance)
+
+        if not merged.any():
+            break
+
+        levels.append(merged)
+
+    return levels
+
+def quadtreeLeaves(levels):
+    '''The merged blocks that are not part of a bigger merged block.
+    Returns a (lines, rows) tuple of block indices for every level.'''
+    leaves = [None] * len(levels)
+    covered = numpy.zeros(levels[-1].shape, dtype=bool)
+
+    for level in range(len(levels) - 1, -1, -1):
+        merged = levels[level]
+
+        if covered.shape != merged.shape:
+            # Every block covers 2 x 2 blocks of the level below. Blocks at the end might not have a parent
+            upsampled = numpy.zeros(merged.shape, dtype=bool)
+            upsampled[:covered.shape[0] * 2, :covered.shape[1] * 2] = numpy.repeat(numpy.repeat(covered, 2, axis=0), 2, axis=1)
+            covered = upsampled
+
+        leaves[level] = numpy.nonzero(merged & ~covered)
+        covered = covered | merged
+
+    return leaves
+
+def blockRing(size):
+    '''(lines, rows) offsets of the points on the border of a block with size x size cells.
+    Counterclockwise seen from above, starting at the bottom left corner.'''
+    lines = numpy.concatenate((numpy.zeros(size), numpy.arange(size), numpy.full(size, size), numpy.arange(size, 0, -1)))
+    rows = numpy.concatenate((numpy.arange(size), numpy.full(size, size), numpy.arange(size, 0, -1), numpy.zeros(size)))
+
+    return (lines.astype(numpy.intp), rows.astype(numpy.intp))
+
+def adaptiveGridFacets(heights, tolerance):
+    '''Triangulates a grid of heights with fewer facets where the heights differ by at most tolerance.
+    Cells are merged into the blocks of a quadtree. A block is split into two triangles when only its
+    corners are used, otherwise its border points are fanned from its center point. The border points
+    of a block include the corners of smaller neighbour blocks, so there are no cracks between the blocks.
+    All points on the border of the grid are used, so the side walls still fit.
+
+    Returns (facets, used). The facets reference the points as line * numberOfRows + row
+    and used marks the points that are part of a facet.'''
+    numberOfLines, numberOfRows = heights.shape
+
+    used = numpy.zeros(heights.shape, dtype=bool)
+    used[[0, -1], :] = True
+    used[:, [0, -1]] = True
+
+    if numberOfLines < 2 or numberOfRows < 2:
+        return (numpy.zeros((0, 3), dtype=numpy.intp), used)
+
+    leaves = quadtreeLeaves(mergedBlocks(heights, tolerance))
+
+    for level, (lines, rows) in enumerate(leaves):
+        size = 2 ** level
+
+        for lineOffset in (0, size):
+            for rowOffset in (0, size):
+                used[lines * size + lineOffset, rows * size + rowOffset] = True
+
+    facets = []
+    usedBefore = used.copy()
+
+    for level, (lines, rows) in enumerate(leaves):
+        if len(lines) == 0:
+            continue
+
+        size = 2 ** level
+        lines = lines * size
+        rows = rows * size
+
+        bottomLeft = lines * numberOfRows + rows
+        bottomRight = bottomLeft + size
+        topLeft = bottomLeft + size * numberOfRows
+        topRight = topLeft + size
+
+        ringLines, ringRows = blockRing(size)
+        ringLines = lines[:, None] + ringLines
+        ringRows = rows[:, None] + ringRows
+        usedRing = usedBefore[ringLines, ringRows]
+
+        simple = usedRing.sum(axis=1) == 4
+
+        facets.append(interleave(numpy.column_stack((bottomLeft[simple], bottomRight[simple], topLeft[simple])),
+                                 numpy.column_stack((bottomRight[simple], topRight[simple], topLeft[simple]))))
+
+        if simple.all():
+            continue
+
+        # Fan the used points on the border of every other block from its center
+        centerLines = lines[~simple] + size // 2
+        centerRows = rows[~simple] + size // 2
+        used[centerLines, centerRows] = True
+
+        blocks, positions = numpy.nonzero(usedRing[~simple])
+        ring = (ringLines[~simple] * numberOfRows + ringRows[~simple])[blocks, positions]
+
+        # The next point on the ring of the same block. The last point of a block is followed by its first one
+        nextPoints = numpy.roll(ring, -1)
+        firstOfBlock = numpy.flatnonzero(numpy.diff(numpy.concatenate(([-1], blocks))))
+        lastOfBlock = numpy.append(firstOfBlock[1:], len(blocks)) - 1
+        nextPoints[lastOfBlock] = ring[firstOfBlock]
+
+        centers = (centerLines * numberOfRows + centerRows)[blocks]
+
+        facets.append(numpy.column_stack((centers, ring, nextPoints)))
+
+    return (numpy.concatenate(facets).astype(numpy.intp), used)
+
+
+def planeFacets(heights, tolerance=None):
+    '''Triangles of a grid of heights. A triangle pair for every cell or adaptiveGridFacets with a tolerance.
+    Returns (facets, used) like adaptiveGridFacets. Without a tolerance all points are used and facets is None.
+    The triangle pairs are only built by planeFacetIndices, once the vertex indices are known.'''
+    if tolerance is None:
+        return (None, numpy.ones(heights.shape, dtype=bool))
+
+    return adaptiveGridFacets(heights, tolerance)
+
+def planeFacetIndices(indices, facets):
+    '''The facets returned by planeFacets for a grid of vertex indices'''
+    if facets is None:
+        return gridFacets(indices)
+
+    return indices.ravel()[facets]
+
+def borderMask(shape):
+    border = numpy.zeros(shape, dtype=bool)
+    border[[0, -1], :] = True
+    border[:, [0, -1]] = True
+
+    return border
+
+def compactIndices(mask, offset=0):
+    '''Consecutive vertex indices starting at offset for the marked points. -1 for all other points'''
+    indices = numpy.full(mask.shape, -1, dtype=numpy.intp)
+    indices[mask] = offset + numpy.arange(numpy.count_nonzero(mask))
+
+    return indices
+
+
+class BoxTopology(object):
+    '''Vertex indices of a box lithophane for a grid of heights.
+    The points of the image come first, followed by the points on the border of the image at the ground (z = 0).
+    The bottom is flat, so it does not need the points inside the border.
+
+    With a tolerance the image plane is triangulated by adaptiveGridFacets and only the points it uses get a vertex.
+
+    Only the vertex indices are computed here. The facets are built when they are requested, so the steps
+    building them can run in parallel. The adaptive triangulation decides which points are used though.'''
+
+    def __init__(self, heights, tolerance=None):
+        numberOfLines, numberOfRows = heights.shape
+
+        self.numberOfLines = numberOfLines
+        self.numberOfRows = numberOfRows
+
+        self.gridFacetIndices, self.used = planeFacets(heights, tolerance)
+
+        # -1 for the points that are not used
+        self.top = compactIndices(self.used)
+
+        self.border = borderMask(heights.shape)
+
+        # -1 for the points inside the border. They have no vertex at the ground
+        self.ground = compactIndices(self.border, numpy.count_nonzero(self.used))
+
+    def vertices(self, xCoordinates, yCoordinates, heights):
+        points = gridVertices(xCoordinates, yCoordinates, heights)
+
+        ground = points[self.border.ravel()]
+        ground[:, 2] = 0
+
+        return numpy.concatenate((points[self.used.ravel()], ground))
+
+    def imagePlaneFacets(self):
+        return planeFacetIndices(self.top, self.gridFacetIndices)
+
+    def blockBaseFacets(self):
+        '''The walls between the border of the image and the ground'''
+        walls = []
+
+        # The first and last line. Only once when there is a single line
+        for lineNumber in sorted(set([0, self.numberOfLines - 1])):
+            walls.append(wallFacets(self.ground[lineNumber], self.top[lineNumber]))
+
+        # The left side is built from the line above to the line below. So the winding is reversed
+        walls.append(wallFacets(self.ground[:, 0], self.top[:, 0])[:, ::-1])
+        walls.append(wallFacets(self.ground[:, -1], self.top[:, -1]))
+
+        return numpy.concatenate(walls)
+
+    def bottomFacets(self):
+        return borderBottomFacets(self.ground)
+
+
+def borderBottomFacets(ground):
+    '''A flat bottom built from the points on the border of a grid of ground vertex indices only.
+    The left and right side are fanned from the point next to the bottom left and bottom right corner.
+    The part in between is a ladder from the first to the last line.'''
+    numberOfLines, numberOfRows = ground.shape
+
+    if numberOfLines < 2 or numberOfRows < 2:
+        return numpy.zeros((0, 3), dtype=ground.dtype)
+
+    if numberOfLines == 2 or numberOfRows == 2:
+        # All points are on the border
+        return gridFacets(ground)
+
+    leftCenter = ground[0, 1]
+    rightCenter = ground[0, -2]
+
+    return numpy.concatenate((fanFacets(leftCenter, ground[:, 0]),
+                              [[leftCenter, ground[-1, 1], ground[-1, 0]]],
+                              gridFacets(ground[[0, -1], 1:-1]),
+                              fanFacets(rightCenter, ground[:, -1])[:, ::-1],
+                              [[rightCenter, ground[-1, -1], ground[-1, -2]]]))
+
+
+def circleTable(numberOfPoints):
+    '''sin and cos of the angles of numberOfPoints points evenly distributed on a circle.
+    The first point is at angle 0 and the points follow clockwise seen from above, like geometry_utils.pointOnCircle.'''
+    angles = numpy.radians(numpy.arange(numberOfPoints) * (360 / numberOfPoints))
+
+    return (numpy.sin(angles), numpy.cos(angles))
+
+def wrapAround(indices):
+    '''Appends the first column of indices to the end. So the last point is connected to the first one'''
+    return numpy.concatenate((indices, indices[..., :1]), axis=-1)
+
+
+class TubeTopology(object):
+    '''Vertex indices of a tube lithophane for a grid of heights.
+    The grid is wrapped around the tube. Column a of the outer grid is the point at the a-th angle,
+    which is row numberOfRows - 1 - a of the image, so the image is not mirrored.
+
+    The points of the outer surface come first, followed by the inner ring at the bottom and the inner ring at the top.
+    The bottom and top circles use the first and last line of the outer surface and the inner rings.'''
+
+    def __init__(self, numberOfLines, numberOfRows):
+        self.numberOfLines = numberOfLines
+        self.numberOfRows = numberOfRows
+
+        self.outer = gridIndices(numberOfLines, numberOfRows)
+        self.innerBottom = gridIndices(1, numberOfRows, self.outer.size)[0]
+        self.innerTop = self.innerBottom + numberOfRows
+
+    def vertices(self, radius, sines, cosines, yCoordinates, heights):
+        '''The points for the radius of the inner surface and the sin and cos of the angles created by circleTable.
+        The y coordinate of a line is used as z coordinate because the image stands upright.'''
+        # The higher the point, the thicker the tube at this point
+        outerRadius = radius + numpy.asarray(heights, dtype=numpy.float64)[:, ::-1]
+
+        outer = numpy.column_stack(((outerRadius * sines).ravel(),
+                                    (outerRadius * cosines).ravel(),
+                                    numpy.repeat(yCoordinates, self.numberOfRows)))
+
+        inner = [numpy.column_stack((radius * sines, radius * cosines, numpy.full(self.numberOfRows, z)))
+                 for z in (yCoordinates[0], yCoordinates[-1])]
+
+        return numpy.concatenate([outer] + inner)
+
+    def innerTubeFacets(self):
+        '''The inside of the tube should be visible, so the facets are counterclockwise seen from the inside'''
+        return wallFacets(wrapAround(self.innerBottom), wrapAround(self.innerTop))
+
+    def outerTubeFacets(self):
+        # The angles go clockwise seen from above. So the winding is reversed for the normals to point outwards
+        return gridFacets(wrapAround(self.outer))[:, ::-1]
+
+    def bottomCircleFacets(self):
+        return wallFacets(wrapAround(self.outer[0]), wrapAround(self.innerBottom))
+
+    def topCircleFacets(self):
+        return wallFacets(wrapAround(self.outer[-1]), wrapAround(self.innerTop))[:, ::-1]
+
+
+class HeightfieldTopology(BoxTopology):
+    '''Vertex indices of a box lithophane with holes. removedCells marks the cells of the grid that are cut away.
+    Every point of a cell that is not removed gets a vertex at the image and at the ground. The walls are built
+    along all edges between a removed and a kept cell and along the border of the grid. So they are oriented
+    correctly, unlike the walls of BoxTopology.'''
+
+    def __init__(self, heights, removedCells):
+        numberOfLines, numberOfRows = heights.shape
+
+        self.numberOfLines = numberOfLines
+        self.numberOfRows = numberOfRows
+        self.kept = ~removedCells
+
+        self.used = numpy.zeros(heights.shape, dtype=bool)
+
+        for lines in (slice(0, -1), slice(1, None)):
+            for rows in (slice(0, -1), slice(1, None)):
+                self.used[lines, rows] |= self.kept
+
+        self.border = self.used
+
+        self.top = compactIndices(self.used)
+        self.ground = compactIndices(self.border, numpy.count_nonzero(self.used))
+
+    def cellFacets(self, indices):
+        '''Two facets for every cell that is not removed'''
+        return gridFacets(indices).reshape(-1, 2, 3)[self.kept.ravel()].reshape(-1, 3)
+
+    def imagePlaneFacets(self):
+        return self.cellFacets(self.top)
+
+    def blockBaseFacets(self):
+        # The cells outside of the grid are removed
+        kept = numpy.pad(self.kept, 1, mode='constant', constant_values=False)
+
+        # Edges along a line between the cells below and above them. Their facets point to -y
+        below = kept[:-1, 1:-1]
+        above = kept[1:, 1:-1]
+        lines, rows = numpy.nonzero(below != above)
+        alongLines = self.edgeWalls((lines, rows), (lines, rows + 1), below[lines, rows])
+
+        # Edges along a row between the cells left and right of them. Their facets point to +x
+        left = kept[1:-1, :-1]
+        right = kept[1:-1, 1:]
+        lines, rows = numpy.nonzero(left != right)
+        alongRows = self.edgeWalls((lines, rows), (lines + 1, rows), right[lines, rows])
+
+        return numpy.concatenate((alongLines, alongRows))
+
+    def edgeWalls(self, start, end, reverse):
+        '''Walls between the start and end points of edges. reverse marks the walls that have to point the other way'''
+        bottomStart, bottomEnd = self.ground[start], self.ground[end]
+        topStart, topEnd = self.top[start], self.top[end]
+
+        walls = interleave(numpy.column_stack((bottomStart, bottomEnd, topStart)),
+                           numpy.column_stack((bottomEnd, topEnd, topStart)))
+
+        # Two facets for every edge
+        reverse = numpy.repeat(reverse, 2)
+        walls[reverse] = walls[reverse][:, ::-1]
+
+        return walls
+
+    def bottomFacets(self):
+        return self.cellFacets(self.ground)[:, ::-1]
+
+
+def gridRegion(xCoordinates, yCoordinates, bounds, padding):
+    '''The smallest part of a grid that contains bounds (xMin, xMax, yMin, yMax) grown by padding.
+    Returns (firstLine, lastLine, firstRow, lastRow) of the points of the region. It is cut to the grid.
+    None when the region is outside of the grid or the whole grid.'''
+    xMin, xMax, yMin, yMax = bounds
+    xMin, xMax, yMin, yMax = (xMin - padding, xMax + padding, yMin - padding, yMax + padding)
+
+    if xMax <= xCoordinates[0] or xMin >= xCoordinates[-1] or yMax <= yCoordinates[0] or yMin >= yCoordinates[-1]:
+        return None
+
+    firstRow = max(numpy.searchsorted(xCoordinates, xMin, 'right') - 1, 0)
+    lastRow = min(numpy.searchsorted(xCoordinates, xMax, 'left'), len(xCoordinates) - 1)
+    firstLine = max(numpy.searchsorted(yCoordinates, yMin, 'right') - 1, 0)
+    lastLine = min(numpy.searchsorted(yCoordinates, yMax, 'left'), len(yCoordinates) - 1)
+
+    if (firstLine, lastLine, firstRow, lastRow) == (0, len(yCoordinates) - 1, 0, len(xCoordinates) - 1):
+        return None
+
+    return (int(firstLine), int(lastLine), int(firstRow), int(lastRow))
+
+def regionsTouch(first, second):
+    '''True when the regions share at least a point of the grid'''
+    return (first[0] <= second[1] and second[0] <= first[1] and
+            first[2] <= second[3] and second[2] <= first[3])
+
+def mergedRegions(regions):
+    '''Replaces all regions that touch each other by the smallest region containing them.
+    So the remaining regions are apart from each other.'''
+    regions = list(regions)
+    merged = True
+
+    while merged:
+        merged = False
+
+        for i in range(len(regions)):
+            for j in range(i + 1, len(regions)):
+                if regionsTouch(regions[i], regions[j]):
+                    first, second = regions[i], regions.pop(j)
+                    regions[i] = (min(first[0], second[0]), max(first[1], second[1]),
+                                  min(first[2], second[2]), max(first[3], second[3]))
+                    merged = True
+                    break
+
+            if merged:
+                break
+
+    return regions
+
+
+class RemainderTopology(BoxTopology):
+    '''Vertex indices of a box lithophane without the boxes of some regions of the grid.
+    regions are (firstLine, lastLine, firstRow, lastRow) of the points of the regions. They must not touch each other,
+    see mergedRegions.
+
+    The remainder is built from the rectangles around the regions. Every rectangle uses all points
+    on its border. So the remainder fits to a BoxTopology of every region, once the walls of these boxes
+    inside the grid (see cutPlanes) are removed. The remainder is open where it touches a region.'''
+
+    def __init__(self, heights, regions, tolerance=None):
+        numberOfLines, numberOfRows = heights.shape
+
+        self.numberOfLines = numberOfLines
+        self.numberOfRows = numberOfRows
+        self.regions = regions
+
+        self.used = numpy.zeros(heights.shape, dtype=bool)
+        self.border = numpy.zeros(heights.shape, dtype=bool)
+
+        self.gridFacetIndices = []
+
+        for lines, rows in self.rectangles():
+            rectangleFacets, rectangleUsed = planeFacets(heights[lines, rows], tolerance)
+
+            self.used[lines, rows] |= rectangleUsed
+            self.border[lines, rows] |= borderMask(rectangleUsed.shape)
+
+            self.gridFacetIndices.append(rectangleFacets)
+
+        self.top = compactIndices(self.used)
+
+        self.ground = compactIndices(self.border, numpy.count_nonzero(self.used))
+
+    def imagePlaneFacets(self):
+        return numpy.concatenate([planeFacetIndices(self.top[lines, rows], rectangleFacets)
+                                  for (lines, rows), rectangleFacets in zip(self.rectangles(), self.gridFacetIndices)])
+
+    def rectangles(self):
+        '''(lines, rows) slices of the rectangles around the regions. The grid is cut into strips of lines
+        at the first and last line of every region. The rows of every strip that no region covers are a rectangle.'''
+        lineBorders = sorted(set([0, self.numberOfLines - 1] + [line for region in self.regions for line in region[:2]]))
+        rectangles = []
+
+        for start, end in zip(lineBorders[:-1], lineBorders[1:]):
+            covered = sorted((firstRow, lastRow) for firstLine, lastLine, firstRow, lastRow in self.regions
+                             if firstLine <= start and end <= lastLine)
+            row = 0
+
+            for firstRow, lastRow in covered:
+                if firstRow > row:
+                    rectangles.append((slice(start, end + 1), slice(row, firstRow + 1)))
+
+                row = lastRow
+
+            if row < self.numberOfRows - 1:
+                rectangles.append((slice(start, end + 1), slice(row, self.numberOfRows)))
+
+        return rectangles
+
+    def cutPlanes(self, xCoordinates, yCoordinates):
+        '''The (axis, value, start, end) planes where the boxes of the regions touch the remainder.
+        start and end limit the plane along the other horizontal axis.'''
+        planes = []
+
+        for firstLine, lastLine, firstRow, lastRow in self.regions:
+            if firstRow > 0:
+                planes.append((0, xCoordinates[firstRow], yCoordinates[firstLine], yCoordinates[lastLine]))
+
+            if lastRow < self.numberOfRows - 1:
+                planes.append((0, xCoordinates[lastRow], yCoordinates[firstLine], yCoordinates[lastLine]))
+
+            if firstLine > 0:
+                planes.append((1, yCoordinates[firstLine], xCoordinates[firstRow], xCoordinates[lastRow]))
+
+            if lastLine < self.numberOfLines - 1:
+                planes.append((1, yCoordinates[lastLine], xCoordinates[firstRow], xCoordinates[lastRow]))
+
+        return planes
+
+    def seamIndices(self):
+        '''The vertex indices of the points on the cut planes'''
+        seams = []
+
+        for firstLine, lastLine, firstRow, lastRow in self.regions:
+            lines = slice(firstLine, lastLine + 1)
+            rows = slice(firstRow, lastRow + 1)
+
+            if firstRow > 0:
+                seams.append((lines, firstRow))
+
+            if lastRow < self.numberOfRows - 1:
+                seams.append((lines, lastRow))
+
+            if firstLine > 0:
+                seams.append((firstLine, rows))
+
+            if lastLine < self.numberOfLines - 1:
+                seams.append((lastLine, rows))
+
+        indices = numpy.concatenate([numpy.ravel(grid[seam]) for seam in seams for grid in (self.top, self.ground)] + [[]])
+
+        return numpy.unique(indices[indices >= 0]).astype(numpy.intp)
+
+    def blockBaseFacets(self):
+        '''The walls of the grid border without the parts that belong to the boxes of the regions'''
+        def outerWall(ground, top, covered):
+            # Two facets for every segment between two points
+            keep = numpy.ones(len(ground) - 1, dtype=bool)
+
+            for first, last in covered:
+                keep[first:last] = False
+
+            return wallFacets(ground, top)[numpy.repeat(keep, 2)]
+
+        regions = self.regions
+
+        walls = [outerWall(self.ground[0], self.top[0], [r[2:] for r in regions if r[0] == 0]),
+                 outerWall(self.ground[-1], self.top[-1], [r[2:] for r in regions if r[1] == self.numberOfLines - 1]),
+                 outerWall(self.ground[:, 0], self.top[:, 0], [r[:2] for r in regions if r[2] == 0])[:, ::-1],
+                 outerWall(self.ground[:, -1], self.top[:, -1], [r[:2] for r in regions if r[3] == self.numberOfRows - 1])]
+
+        return numpy.concatenate(walls)
+
+    def bottomFacets(self):
+        return numpy.concatenate([borderBottomFacets(self.ground[lines, rows]) for lines, rows in self.rectangles()])
+
+
+def onPlanes(points, planes, tolerance):
+    '''Marks the points that lie in one of the (axis, value, start, end) planes of RemainderTopology.cutPlanes'''
+    onPlane = numpy.zeros(len(points), dtype=bool)
+
+    for axis, value, start, end in planes:
+        # The other horizontal axis
+        along = points[:, 1 - axis]
+
+        onPlane |= (numpy.abs(points[:, axis] - value) <= tolerance) & (along >= start - tolerance) & (along <= end + tolerance)
+
+    return onPlane
+
+def removePlaneFacets(points, facets, planes, tolerance):
+    '''Removes the facets whose points all lie in one of the (axis, value, start, end) planes'''
+    removed = numpy.zeros(len(facets), dtype=bool)
+
+    for plane in planes:
+        removed |= onPlanes(points, [plane], tolerance)[facets].all(axis=1)
+
+    return facets[~removed]
+
+def nearestPoints(points, targets, tolerance):
+    '''The index of the nearest target of every point or -1 when no target is at most tolerance away from it'''
+    nearest = numpy.full(len(points), -1, dtype=numpy.intp)
+
+    if len(targets) == 0:
+        return nearest
+
+    # Chunks keep the matrix of distances small
+    chunkSize = max(1, 1000000 // len(targets))
+
+    for start in range(0, len(points), chunkSize):
+        chunk = points[start:start + chunkSize]
+        distances = numpy.linalg.norm(chunk[:, None, :] - targets[None, :, :], axis=2)
+        chunkNearest = numpy.argmin(distances, axis=1)
+        inReach = distances[numpy.arange(len(chunk)), chunkNearest] <= tolerance
+
+        nearest[start:start + chunkSize][inReach] = chunkNearest[inReach]
+
+    return nearest
+
+def removeDegenerateFacets(facets):
+    '''Removes the facets that use a point more than once'''
+    degenerate = (facets[:, 0] == facets[:, 1]) | (facets[:, 1] == facets[:, 2]) | (facets[:, 2] == facets[:, 0])
+
+    return facets[~degenerate]
+
+def facetEdges(facets):
+    '''The (a, b) edges of every facet as (N, 3, 2) array'''
+    return facets[:, [[0, 1], [1, 2], [2, 0]]]
+
+def edgeUsage(facets):
+    '''How many facets share each edge of each facet as (N, 3) array'''
+    edges = numpy.sort(facetEdges(facets).reshape(-1, 2), axis=1)
+    _, inverse, counts = numpy.unique(edges, axis=0, return_inverse=True, return_counts=True)
+
+    return counts[inverse.reshape(-1)].reshape(-1, 3)
+
+def isClosed(facets):
+    '''True when every edge is shared by exactly two facets'''
+    return len(facets) > 0 and bool((edgeUsage(facets) == 2).all())
+
+def repairTJunctions(points, facets, tolerance, maximumPasses=4, onSeam=None):
+    '''Splits the facets with an open edge that has points of other open edges on it.
+    This happens when one side of a seam has points on a straight edge that the other side does not have.
+    With onSeam only the edges between two marked points can be open. So the facets can be a part of a mesh.'''
+    for _ in range(maximumPasses):
+        edges = facetEdges(facets)
+        openEdges = edgeUsage(facets) == 1
+
+        if onSeam is not None:
+            openEdges &= onSeam[edges].all(axis=2)
+
+        if not openEdges.any():
+            break
+        openPoints = numpy.unique(edges[openEdges])
+        candidates = points[openPoints]
+
+        splitFacets = []
+        newFacets = []
+
+        for facetIndex, edgeIndex in zip(*numpy.nonzero(openEdges)):
+            if facetIndex in splitFacets:
+                # Split in the next pass
+                continue
+
+            a, b = edges[facetIndex, edgeIndex]
+            c = facets[facetIndex, (edgeIndex + 2) % 3]
+
+            direction = points[b] - points[a]
+            position = numpy.dot(candidates - points[a], direction) / numpy.dot(direction, direction)
+            distance = numpy.linalg.norm(candidates - (points[a] + position[:, None] * direction), axis=1)
+
+            onEdge = (position > 0) & (position < 1) & (distance <= tolerance) & (openPoints != a) & (openPoints != b)
+
+            if not onEdge.any():
+                continue
+
+            chain = numpy.concatenate(([a], openPoints[onEdge][numpy.argsort(position[onEdge])], [b]))
+
+            splitFacets.append(facetIndex)
+            newFacets.append(numpy.column_stack((chain[:-1], chain[1:], numpy.full(len(chain) - 1, c))))
+
+        if len(splitFacets) == 0:
+            break
+
+        facets = numpy.concatenate([numpy.delete(facets, splitFacets, axis=0)] + newFacets)
+
+    return facets
+
+def stitchPatch(points, facets, seam, patchPoints, patchFacets, planes, tolerance):
+    '''Adds a closed patch to a mesh that is open where the patch touches it. seam are the indices of the mesh points
+    on the (axis, value, start, end) planes. The facets of the patch on the planes are removed and its points on the planes
+    are merged with the nearest seam point. Only the facets at the seam are looked at, so the work grows with the size
+    of the patch and the seam and not with the size of the mesh. The mesh has to be closed besides the seam.
+
+    Returns (points, facets, closed). closed tells whether every edge of the patch and at the seam is shared by two facets.'''
+    numberOfPoints = len(points)
+    patchFacets = removePlaneFacets(patchPoints, patchFacets, planes, tolerance)
+
+    patchSeam = numpy.flatnonzero(onPlanes(patchPoints, planes, tolerance))
+    nearest = nearestPoints(patchPoints[patchSeam], points[seam], tolerance)
+    merged = nearest >= 0
+
+    # Merged patch points use the seam point of the mesh. All others are appended to the points of the mesh
+    kept = numpy.ones(len(patchPoints), dtype=bool)
+    kept[patchSeam[merged]] = False
+
+    indices = numpy.empty(len(patchPoints), dtype=numpy.intp)
+    indices[kept] = len(points) + numpy.arange(numpy.count_nonzero(kept))
+    indices[patchSeam[merged]] = seam[nearest[merged]]
+
+    patchFacets = removeDegenerateFacets(indices[patchFacets])
+    points = numpy.concatenate((points, patchPoints[kept]))
+
+    onSeam = numpy.zeros(len(points), dtype=bool)
+    onSeam[seam] = True
+    onSeam[indices[patchSeam]] = True
+
+    # The facets of the mesh away from the seam stay as they are
+    atSeam = onSeam[facets].any(axis=1)
+    seamFacets = repairTJunctions(points, numpy.concatenate((facets[atSeam], patchFacets)), tolerance, onSeam=onSeam)
+
+    # Edges of the mesh without a point on the seam might be shared with a facet away from the seam. They are closed anyway
+    edges = facetEdges(seamFacets)
+    checked = onSeam[edges].any(axis=2) | (edges >= numberOfPoints).all(axis=2)
+    closed = len(seamFacets) > 0 and bool((edgeUsage(seamFacets)[checked] == 2).all())
+
+    return (points, numpy.concatenate((facets[~atSeam], seamFacets)), closed)
@@ -0,0 +1,74 @@
+'''Applies all boolean operations of a Boolean Mesh with a single OpenSCAD call'''
+import os
+import tempfile
+
+import Mesh
+
+MODE_MAPPING = {
+    'Additive': 'union',
+    'Subtractive': 'difference'
+}
+
+
+def writeMesh(mesh, dir, file):
+    '''Writes the mesh as binary STL. It is a lot smaller and faster to parse than ASCII STL'''
+    fileName = os.path.join(dir, file + '.stl')
+
+    mesh.write(fileName, 'STL')
+
+    # OpenSCAD wants forward slashes on every platform
+    return fileName.replace('\\', '/')
+
+
+def importStatement(fileName):
+    return 'import(file = "%s");' % (fileName)
+
+
+def groupByMode(operations):
+    '''Combines operations in a row with the same mode. They can be applied by a single union or difference.
+    Returns [(mode, [file])]'''
+    groups = []
+
+    for fileName, mode in operations:
+        if len(groups) > 0 and groups[-1][0] == mode:
+            groups[-1][1].append(fileName)
+        else:
+            groups.append((mode, [fileName]))
+
+    return groups
+
+
+def buildScript(baseFile, operations):
+    '''The script applying the operations in order to the base mesh.
+    baseFile the file of the base mesh
+    operations [(file, mode)]'''
+    script = importStatement(baseFile)
+
+    for mode, fileNames in groupByMode(operations):
+        script = '%s() {\n%s\n%s\n}' % (MODE_MAPPING[mode], script, '\n'.join(importStatement(fileName) for fileName in fileNames))
+
+    return script
+
+
+def applyBooleanOperations(base, operations):
+    '''
+    base the base mesh
+    operations [(mesh, mode, name)]'''
+    import OpenSCADUtils
+
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        baseFile = writeMesh(base, tmpdirname, 'base')
+
+        # Feature names are unique in a document, but the index keeps the file names short and safe
+        featureFiles = [(writeMesh(mesh, tmpdirname, 'feature%s' % (index)), mode)
+                        for index, (mesh, mode, name) in enumerate(operations)]
+
+        resultPath = OpenSCADUtils.callopenscadstring(buildScript(baseFile, featureFiles), 'stl')
+
+        try:
+            resultMesh = Mesh.Mesh()
+            resultMesh.read(resultPath)
+        finally:
+            os.unlink(resultPath)
+
+        return resultMesh
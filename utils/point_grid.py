@@ -0,0 +1,162 @@
+'''Compact storage for the point cloud of a lithophane image.
+
+Only the heights are stored as float32 array. The x and y coordinates of a point
+are calculated from the grid spacing and origin whenever they are needed.
+'''
+import base64
+import zlib
+
+import numpy
+import FreeCAD
+
+
+def pointCoordinates(point):
+    if hasattr(point, 'x'):
+        return (point.x, point.y, point.z)
+
+    return (point[0], point[1], point[2])
+
+
+class GridLines(object):
+    '''Read only view of a PointGrid that looks like the old list of lines.
+    A line is a list of FreeCAD.Vector and is created only when it is accessed.'''
+
+    def __init__(self, grid):
+        self.grid = grid
+
+    def __len__(self):
+        return self.grid.numberOfLines()
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.grid.line(lineIndex) for lineIndex in range(*index.indices(len(self)))]
+
+        return self.grid.line(index)
+
+    def __iter__(self):
+        for lineIndex in range(len(self)):
+            yield self.grid.line(lineIndex)
+
+
+class PointGrid(object):
+    '''Heights of a regular grid of points.
+    heights[0] is the line at the bottom (y = origin y) and heights[line][0] the leftmost point (x = origin x) of a line.'''
+
+    def __init__(self, heights, spacing, origin=(0, 0)):
+        self.heights = numpy.ascontiguousarray(heights, dtype=numpy.float32)
+        self.spacing = float(spacing)
+        self.origin = (float(origin[0]), float(origin[1]))
+
+        # Set when the heights are rounded to layer heights
+        self.numberOfLayers = None
+
+        self.lines = GridLines(self)
+        self.xCoordinateList = None
+
+    @staticmethod
+    def fromLines(lines):
+        '''Creates a grid from a list of lines. A point can be a FreeCAD.Vector or a (x, y, z) tuple'''
+        points = numpy.array([[pointCoordinates(point) for point in line] for line in lines], dtype=numpy.float64)
+
+        origin = (points[0, 0, 0], points[0, 0, 1])
+
+        if points.shape[1] > 1:
+            spacing = points[0, 1, 0] - points[0, 0, 0]
+        elif points.shape[0] > 1:
+            spacing = points[1, 0, 1] - points[0, 0, 1]
+        else:
+            spacing = 1
+
+        return PointGrid(points[:, :, 2], spacing, origin)
+
+    def withHeights(self, heights, spacing=None):
+        '''A new grid with the same origin but other heights'''
+        if spacing is None:
+            spacing = self.spacing
+
+        return PointGrid(heights, spacing, self.origin)
+
+    def copy(self):
+        pointGrid = self.withHeights(self.heights.copy())
+        pointGrid.numberOfLayers = self.numberOfLayers
+
+        return pointGrid
+
+    def numberOfLines(self):
+        return self.heights.shape[0]
+
+    def numberOfRows(self):
+        return self.heights.shape[1]
+
+    def xCoordinates(self):
+        return self.origin[0] + numpy.arange(self.numberOfRows(), dtype=numpy.float64) * self.spacing
+
+    def yCoordinates(self):
+        return self.origin[1] + numpy.arange(self.numberOfLines(), dtype=numpy.float64) * self.spacing
+
+    def length(self):
+        '''x coordinate of the last point in a line'''
+        return self.origin[0] + (self.numberOfRows() - 1) * self.spacing
+
+    def width(self):
+        '''y coordinate of the last line'''
+        return self.origin[1] + (self.numberOfLines() - 1) * self.spacing
+
+    def point(self, lineIndex, rowIndex):
+        return FreeCAD.Vector(self.origin[0] + rowIndex * self.spacing,
+                              self.origin[1] + lineIndex * self.spacing,
+                              float(self.heights[lineIndex, rowIndex]))
+
+    def line(self, lineIndex):
+        numberOfLines = self.numberOfLines()
+
+        if lineIndex < 0:
+            lineIndex += numberOfLines
+
+        if lineIndex < 0 or lineIndex >= numberOfLines:
+            raise IndexError('line index out of range')
+
+        if self.xCoordinateList is None:
+            self.xCoordinateList = self.xCoordinates().tolist()
+
+        y = self.origin[1] + lineIndex * self.spacing
+
+        return [FreeCAD.Vector(x, y, z) for x, z in zip(self.xCoordinateList, self.heights[lineIndex].tolist())]
+
+    def points(self):
+        '''All points of the grid as (numberOfLines * numberOfRows, 3) array. Line by line starting at the bottom'''
+        x, y = numpy.meshgrid(self.xCoordinates(), self.yCoordinates())
+
+        return numpy.column_stack((x.ravel(), y.ravel(), self.heights.ravel().astype(numpy.float64)))
+
+
+def gridToState(pointGrid):
+    '''Converts the grid into something that can be stored in a FreeCAD document.
+    The heights are stored as zlib compressed little endian float32 values in base64.'''
+    heights = pointGrid.heights.astype('<f4', copy=False)
+    compressed = zlib.compress(heights.tobytes())
+
+    return {
+        'lines': pointGrid.numberOfLines(),
+        'rows': pointGrid.numberOfRows(),
+        'spacing': pointGrid.spacing,
+        'origin': list(pointGrid.origin),
+        'numberOfLayers': pointGrid.numberOfLayers,
+        'heights': base64.b64encode(compressed).decode('ascii')
+    }
+
+def gridExtentFromState(state):
+    '''Length and width of the grid stored in state without decoding the heights'''
+    length = state['origin'][0] + (state['rows'] - 1) * state['spacing']
+    width = state['origin'][1] + (state['lines'] - 1) * state['spacing']
+
+    return (length, width)
+
+def gridFromState(state):
+    compressed = base64.b64decode(state['heights'].encode('ascii'))
+    heights = numpy.frombuffer(zlib.decompress(compressed), dtype='<f4').astype(numpy.float32)
+
+    pointGrid = PointGrid(heights.reshape(state['lines'], state['rows']), state['spacing'], state['origin'])
+    pointGrid.numberOfLayers = state.get('numberOfLayers')
+
+    return pointGrid
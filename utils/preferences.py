@@ -11,6 +11,44 @@ def getBlenderExecutable():
     return params.GetString('BlenderExecutable')
 
 
+def getStepCacheSize():
+    '''Memory in MB the results of the image processing steps can use'''
+    return params.GetInt('StepCacheSize')
+
+
+def useHeightmapCache():
+    return params.GetBool('UseHeightmapCache')
+
+
+def getHeightmapCacheSize():
+    '''Disk space in MB the heightmap cache can use'''
+    return params.GetInt('HeightmapCacheSize')
+
+
+def useLazyRestore():
+    return params.GetBool('LazyRestore')
+
+
+def getTileSize():
+    '''Number of image lines that are decoded at once in tiled mode'''
+    return params.GetInt('TileSize')
+
+
+def getWorkerProcesses():
+    '''Number of processes that compute the point cloud. 1 computes it in FreeCAD itself'''
+    return params.GetInt('WorkerProcesses')
+
+
+def getPreviewTextureSize():
+    '''Maximum width and height in pixels of the texture that shows an image in the 3D view'''
+    return params.GetInt('PreviewTextureSize')
+
+
+def getTessellationCacheSize():
+    '''Memory in MB the meshes of tessellated shapes of boolean features can use'''
+    return params.GetInt('TessellationCacheSize')
+
+
 def setupParameters():
     paramVersion = params.GetInt('ParamVersion')
 
@@ -19,6 +57,35 @@ def setupParameters():
         params.SetBool('UseBlenderForBooleanOperations', False)
         params.SetString('BlenderExecutable', ' ')
 
+    if paramVersion < 2:
+        params.SetInt('ParamVersion', 2)
+        params.SetInt('StepCacheSize', 512)
+
+    if paramVersion < 3:
+        params.SetInt('ParamVersion', 3)
+        params.SetBool('UseHeightmapCache', True)
+        params.SetInt('HeightmapCacheSize', 1024)
+
+    if paramVersion < 4:
+        params.SetInt('ParamVersion', 4)
+        params.SetBool('LazyRestore', True)
+
+    if paramVersion < 5:
+        params.SetInt('ParamVersion', 5)
+        params.SetInt('TileSize', 1024)
+
+    if paramVersion < 6:
+        params.SetInt('ParamVersion', 6)
+        params.SetInt('WorkerProcesses', 1)
+
+    if paramVersion < 7:
+        params.SetInt('ParamVersion', 7)
+        params.SetInt('PreviewTextureSize', 2048)
+
+    if paramVersion < 8:
+        params.SetInt('ParamVersion', 8)
+        params.SetInt('TessellationCacheSize', 256)
+
 
 if __name__ == '__main__':
     setupParameters()
@@ -13,6 +13,7 @@ import time
 QByteArray = QtCore.QByteArray
 QBuffer = QtCore.QBuffer
 QIODevice = QtCore.QIODevice
+QSize = QtCore.QSize
 Qt = QtCore.Qt
 QImage = QtGui.QImage
 QColor = QtGui.QColor
@@ -24,6 +25,7 @@ QPalette = QtWidgets.QPalette
 QSizePolicy = QtWidgets.QSizePolicy
 QPixmap = QtWidgets.QPixmap
 QThread = QtCore.QThread
+QTimer = QtCore.QTimer
 
 # File patterns
 IMAGE_FILES = "Image Files (*.png *.jpg *.bmp)"
@@ -46,8 +48,67 @@ def showInfo(title, message):
     QtWidgets.QMessageBox.information(activeWindow(), title, message)
 
 def readImage(imagePath):
-    imageReader = QtGui.QImageReader(imagePath)
+    return readWithImageReader(QtGui.QImageReader(imagePath))
 
+def imageDataBuffer(data):
+    buffer = QBuffer()
+    buffer.setData(QByteArray(data))
+    buffer.open(QIODevice.ReadOnly)
+
+    return buffer
+
+def scaledSize(size, scaleDown):
+    return ((size.width() + scaleDown - 1) // scaleDown, (size.height() + scaleDown - 1) // scaleDown)
+
+def imageDataSize(data, scaleDown=1):
+    '''(width, height) of the image when it is decoded with readImageData. Only the header of the image is read'''
+    buffer = imageDataBuffer(data)
+
+    return scaledSize(QtGui.QImageReader(buffer).size(), scaleDown)
+
+def readImageData(data, scaleDown=1, clipRect=None):
+    '''Decodes the content of an image file. The format is detected from the data itself.
+    With scaleDown > 1 the image is decoded to 1 / scaleDown of its width and height.
+    clipRect is a (x, y, width, height) tuple in the coordinates of the scaled image. Only this part of the image is returned.
+    Formats that support clipping don't need to decode the whole image for it.'''
+    return readImageBuffer(imageDataBuffer(data), scaleDown, clipRect)
+
+def readImageBuffer(buffer, scaleDown=1, clipRect=None):
+    '''Does the same as readImageData for a buffer created by imageDataBuffer.
+    So parts of the same image can be read without copying the data for every part.'''
+    buffer.seek(0)
+    imageReader = QtGui.QImageReader(buffer)
+
+    if scaleDown > 1:
+        imageReader.setScaledSize(QtCore.QSize(*scaledSize(imageReader.size(), scaleDown)))
+
+        if clipRect is not None:
+            imageReader.setScaledClipRect(QtCore.QRect(*clipRect))
+    elif clipRect is not None:
+        imageReader.setClipRect(QtCore.QRect(*clipRect))
+
+    return readWithImageReader(imageReader)
+
+def supportsScaledDecode(data):
+    '''True when the image can be decoded to a smaller size without decoding it in full size first.
+    Only the JPEG decoder does this. Other formats scale the full size image after decoding it.'''
+    buffer = imageDataBuffer(data)
+    imageReader = QtGui.QImageReader(buffer)
+
+    return imageReader.format().data() in (b'jpeg', b'jpg') and imageReader.supportsOption(QtGui.QImageIOHandler.ScaledSize)
+
+def supportsClipRect(data, scaleDown=1):
+    '''True when a part of the image can be decoded without decoding the whole image.
+    Formats that don't support it decode the whole image and clip it afterwards.'''
+    buffer = imageDataBuffer(data)
+    imageReader = QtGui.QImageReader(buffer)
+
+    if scaleDown > 1:
+        return imageReader.supportsOption(QtGui.QImageIOHandler.ScaledClipRect)
+
+    return imageReader.supportsOption(QtGui.QImageIOHandler.ClipRect)
+
+def readWithImageReader(imageReader):
     if imageReader.canRead():
         image = imageReader.read() 
 
@@ -58,6 +119,44 @@ def readImage(imagePath):
     else:
         showInfo("Image Read Error", "Can't read image: %s" % imageReader.errorString())
 
+def imageToArgbArray(image):
+    '''Returns the pixels of the image as a (height, width) array of 32 bit ARGB values.
+    The image is converted to non premultiplied ARGB32 first, so the values are the same
+    as the ones returned by image.pixel(x, y)'''
+    import numpy
+
+    if image.format() != QImage.Format_ARGB32:
+        image = image.convertToFormat(QImage.Format_ARGB32)
+
+    height = image.height()
+    bytesPerLine = image.bytesPerLine()
+
+    bits = image.constBits()
+
+    # PyQt returns a sip.voidptr that must know its size before it can be used as buffer
+    if hasattr(bits, 'setsize'):
+        bits.setsize(height * bytesPerLine)
+
+    # Copy the data, the buffer is only valid as long as the (possibly converted) image lives
+    data = numpy.frombuffer(bits, dtype=numpy.uint8, count=height * bytesPerLine).copy()
+
+    return data.view(numpy.uint32).reshape(height, bytesPerLine // 4)[:, :image.width()]
+
+def lightnessTable():
+    '''The lightness QColor calculates for every possible sum of the largest and smallest color component.
+    Lightness only depends on this sum, so the table can be used to compute it for a whole image at once.'''
+    import numpy
+
+    table = numpy.empty(511, dtype=numpy.int32)
+
+    for componentSum in range(511):
+        maximum = min(255, componentSum)
+        minimum = componentSum - maximum
+
+        table[componentSum] = QColor(maximum, minimum, minimum).lightness()
+
+    return table
+
 def processEvents():
     QtGui.QApplication.processEvents()
     time.sleep(0.1)
@@ -0,0 +1,165 @@
+'''Process pool for computations that don't run fast enough in a single thread.
+
+FreeCAD's sys.executable is FreeCAD itself. So the processes are started with the
+python interpreter that comes with FreeCAD. Large arrays are passed to the processes
+in shared memory instead of copying them.
+
+The interpreter that is found might not be able to import numpy or our modules. And a worker that dies
+loses its task, so the pool would wait for it forever. So the pool is checked when it is created and
+all tasks have a timeout. When something goes wrong, everything is computed in a single process.
+'''
+import os
+import sys
+import math
+import atexit
+import multiprocessing
+
+import numpy
+import FreeCAD
+
+from utils import preferences
+from utils import heightmap
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # Python < 3.8
+    shared_memory = None
+
+POOL = None
+POOL_SIZE = 0
+
+# Seconds the workers have to start and import the modules they need
+STARTUP_TIMEOUT = 60
+
+# Seconds every process has for a task
+TASK_TIMEOUT = 120
+
+
+def numberOfProcesses():
+    if shared_memory is None:
+        return 1
+
+    return max(1, preferences.getWorkerProcesses())
+
+def pythonExecutable():
+    '''The interpreter that comes with FreeCAD. The one with the same version as FreeCAD's python is preferred'''
+    if os.path.basename(sys.executable).lower().startswith('python'):
+        # FreeCAD is imported as module
+        return sys.executable
+
+    directories = [os.path.join(FreeCAD.getHomePath(), 'bin'), os.path.dirname(sys.executable)]
+    versionedName = 'python%s.%s' % sys.version_info[:2]
+
+    for directory in directories:
+        for name in ('python.exe', versionedName, 'python3', 'python'):
+            fileName = os.path.join(directory, name)
+
+            if os.path.isfile(fileName):
+                return fileName
+
+    return None
+
+def getPool():
+    '''The pool with the configured number of processes or None when only one process should be used'''
+    global POOL, POOL_SIZE
+
+    processes = numberOfProcesses()
+
+    if processes == POOL_SIZE:
+        return POOL
+
+    closePool()
+
+    if processes <= 1:
+        return None
+
+    executable = pythonExecutable()
+
+    if executable is None:
+        FreeCAD.Console.PrintWarning('No python interpreter found to start worker processes. Computing in a single process\n')
+
+        return None
+
+    context = multiprocessing.get_context('spawn')
+    context.set_executable(executable)
+
+    pool = context.Pool(processes)
+
+    # A pool that failed stays disabled until the number of processes changes
+    POOL_SIZE = processes
+
+    if not checkPool(pool, processes):
+        pool.terminate()
+
+        FreeCAD.Console.PrintWarning('The worker processes started with %s can not compute the point cloud. Computing in a single process\n' % (executable))
+
+        return None
+
+    POOL = pool
+
+    return POOL
+
+def checkPool(pool, processes):
+    '''True when the workers can import the modules they need. Workers that die while importing them
+    are restarted by the pool again and again, so the check gives up after STARTUP_TIMEOUT'''
+    values = list(range(processes))
+
+    try:
+        return pool.map_async(heightmap.checkWorker, values).get(STARTUP_TIMEOUT) == values
+    except Exception:
+        return False
+
+def mapTasks(pool, function, tasks):
+    '''Does the same as pool.map but gives up when the tasks do not finish in time.
+    Returns None in this case and the pool is not used anymore.'''
+    rounds = max(1, int(math.ceil(len(tasks) / POOL_SIZE)))
+
+    try:
+        return pool.map_async(function, tasks).get(TASK_TIMEOUT * rounds)
+    except multiprocessing.TimeoutError:
+        FreeCAD.Console.PrintWarning('The worker processes did not finish in time. Computing in a single process\n')
+
+        disablePool()
+
+        return None
+
+def closePool():
+    global POOL_SIZE
+
+    disablePool()
+
+    POOL_SIZE = 0
+
+def disablePool():
+    '''Stops the processes. getPool returns None until the number of processes changes'''
+    global POOL
+
+    if POOL is not None:
+        POOL.terminate()
+
+    POOL = None
+
+atexit.register(closePool)
+
+
+class SharedArray(object):
+    '''Copy of a numpy array in shared memory. Use it as context manager to remove the memory afterwards'''
+
+    def __init__(self, array):
+        self.shape = array.shape
+        self.dtype = array.dtype
+        self.memory = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+
+        numpy.ndarray(self.shape, dtype=self.dtype, buffer=self.memory.buf)[...] = array
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.memory.close()
+        self.memory.unlink()